@@ -23,9 +23,32 @@ from CTFd.utils.user import get_ip
 from CTFd.utils.uploads import delete_file
 from CTFd.utils.decorators import admins_only
 
-from .models import UniqueFlags, UniqueChallenges, UniqueChallengeFiles
-from .helpers import get_unique_challenge_description, replace_submission, meets_advanced_requirements
+from .storage import remove_content
+from .models import (
+    UniqueFlags,
+    UniqueChallenges,
+    UniqueChallengeFiles,
+    UniqueChallengeRequirementDependency,
+    UniqueAuditFinding,
+)
+from .helpers import (
+    get_unique_challenge_description,
+    replace_submission,
+    meets_advanced_requirements,
+    meets_advanced_requirements_many,
+    invalidate_requirements,
+    index_requirement_dependencies,
+    register_requirement_listeners,
+    bump_requirement_versions,
+    invalidate_description,
+    delete_unique_files,
+    get_script_pool,
+    record_flag_leaks,
+    ensure_flag_secret,
+    invalidate_live_flag_index,
+)
 from .api import API_NAMESPACE
+from .migrations import upgrade
 
 class UniqueChallenge(BaseChallenge):
     """ Defines a unique challenge type, where users will be given challenges
@@ -83,6 +106,7 @@ class UniqueChallenge(BaseChallenge):
             setattr(challenge, attr, value)
 
         db.session.commit()
+        invalidate_description(challenge.id)
         return challenge
 
     @staticmethod
@@ -91,12 +115,14 @@ class UniqueChallenge(BaseChallenge):
         files = ChallengeFiles.query.filter_by(challenge_id=challenge.id).all()
         for file in files:
             delete_file(file.id)
-        UniqueChallengeFiles.query.filter_by(challenge_id=challenge.id).delete()
+        unused = delete_unique_files(UniqueChallengeFiles.query.filter_by(challenge_id=challenge.id))
 
         tables = [
+            UniqueAuditFinding,
             Fails,
             Solves,
             UniqueFlags,
+            UniqueChallengeRequirementDependency,
             Flags,
             ChallengeFiles,
             Tags,
@@ -109,6 +135,12 @@ class UniqueChallenge(BaseChallenge):
             table.query.filter_by(id=challenge.id).delete()
 
         db.session.commit()
+        remove_content(unused)
+        invalidate_requirements(challenge.id)
+        invalidate_description(challenge.id)
+        invalidate_live_flag_index(challenge.id)
+        # Bulk deletes skip the listeners, and solves or a challenge name may have disappeared.
+        bump_requirement_versions('global')
 
     @staticmethod
     def attempt(challenge, request):
@@ -129,12 +161,36 @@ class UniqueChallenge(BaseChallenge):
         return False, "Incorrect"
 
     solve = CTFdStandardChallenge.solve
-    fail = CTFdStandardChallenge.fail
+
+    @staticmethod
+    def fail(user, team, challenge, request):
+        """ Records an incorrect submission, along with any other account's flags it contains.
+        Unlike the standard fail, the submission is flushed first so findings can reference it. """
+        data = request.form or request.get_json()
+        submission = data["submission"].strip()
+        wrong = Fails(
+            user_id=user.id,
+            team_id=team.id if team else None,
+            challenge_id=challenge.id,
+            ip=get_ip(request),
+            provided=submission,
+        )
+        db.session.add(wrong)
+        db.session.flush()
+        record_flag_leaks(wrong)
+        db.session.commit()
+        db.session.close()
 
 def load(app):
     """ Load the unique challenges plugin """
 
     app.db.create_all()
+    upgrade()
+    ensure_flag_secret()
+    index_requirement_dependencies()
+    register_requirement_listeners()
+    # Fork the script workers before the web server starts any threads
+    get_script_pool().start()
     CHALLENGE_CLASSES["unique"] = UniqueChallenge
     register_plugin_assets_directory(
         app, base_path="/plugins/unique_challenges/assets/")
@@ -147,7 +203,8 @@ def load(app):
     def configure_route():
         return render_template(
             "unique_challenges.html",
-            filter_list=get_config("unique_challenges_filter_list", False)
+            filter_list=get_config("unique_challenges_filter_list", False),
+            flag_mode=get_config("unique_challenges_flag_mode", "stored")
         )
 
     api = Api(api_blueprint)
@@ -160,8 +217,9 @@ def load(app):
     def challenges_list(*args, **kwargs):
         result = old_challenges_list(*args, **kwargs)
         if get_config("unique_challenges_filter_list", False):
+            allowed = meets_advanced_requirements_many(challenge['id'] for challenge in result.json['data'])
             result.json['data'] = [
-                challenge for challenge in result.json['data'] if meets_advanced_requirements(challenge['id'])
+                challenge for challenge in result.json['data'] if allowed[challenge['id']]
             ]
             return result.json
         return result
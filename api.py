@@ -2,23 +2,74 @@
 Contains all of the /api/unique/* routes added by this plugin.
 """
 
-import io
+import hashlib
+import unicodedata
+from urllib.parse import quote
 
-from flask import request, send_file, abort
-from sqlalchemy import text
+from flask import request, abort, Response, stream_with_context
 from flask_restplus import Namespace, Resource
-from CTFd.models import db, Submissions, Users, Teams
+from CTFd.models import db, Users, Teams
 from CTFd.utils import set_config
 from CTFd.utils.decorators import admins_only
 from CTFd.utils.dates import ctftime
 from CTFd.utils.user import is_admin
 
-from .models import UniqueChallengeFiles, UniqueChallenges, UniqueChallengeScript, UniqueChallengeRequirements, UniqueFlags, UniqueChallengeCohort, UniqueChallengeCohortMembership
-from .helpers import get_unique_challenge_file, get_generated_challenge_file, meets_advanced_requirements
+from .storage import remove_content
+from .models import UniqueChallengeFiles, UniqueChallenges, UniqueChallengeScript, UniqueChallengeRequirements, UniqueChallengeCohort, UniqueChallengeCohortMembership
+from .helpers import (
+    get_unique_challenge_file,
+    get_generated_challenge_file,
+    meets_advanced_requirements,
+    invalidate_requirements,
+    save_requirement_dependencies,
+    bump_requirement_versions,
+    start_flag_provisioning,
+    set_flag_mode,
+    flag_provisioning_status,
+    audit_status,
+    request_audit_update,
+    start_audit_update,
+    audit_findings_page,
+    store_unique_file,
+    invalidate_script,
+    delete_unique_files,
+    generated_file_warmup_status,
+    start_generated_file_warmup,
+)
 from .lispish import LispIsh, LispIshParseError
 
 API_NAMESPACE = Namespace("unique", description="API endpoint for unique challenges")
 
+def stream_attachment(chunks, name: str, length: int = None) -> Response:
+    """ Streams the given chunks to the client as a file download """
+    response = Response(stream_with_context(chunks), mimetype='application/octet-stream')
+    # Header values must be latin-1, so like send_file, non-ASCII names are sent RFC 2231 encoded
+    # along with an ASCII approximation for old clients.
+    try:
+        name.encode('ascii')
+        filenames = {'filename': name}
+    except UnicodeEncodeError:
+        filenames = {
+            'filename': unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode('ascii'),
+            'filename*': "UTF-8''" + quote(name, safe=''),
+        }
+    response.headers.add('Content-Disposition', 'attachment', **filenames)
+    if length is not None:
+        response.headers['Content-Length'] = str(length)
+    return response
+
+def send_download(download, name: str, weak: bool = False) -> Response:
+    """ Sends a file download, or tells the client to use its copy if it is not modified.
+    Clients must revalidate their copy since the file changes if the account's flags do. """
+    if download.chunks is None:
+        response = Response(status=304)
+    else:
+        response = stream_attachment(download.chunks, name, download.length)
+    response.set_etag(download.etag, weak)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
 @API_NAMESPACE.route("/files")
 class Files(Resource):
     """ Allows users to upload unique files. """
@@ -32,10 +83,11 @@ class Files(Resource):
         for file in request.files.getlist('file'):
             upload = UniqueChallengeFiles(
                 name=file.filename,
-                content=file.stream.read(),
                 challenge_id=challenge_id
             )
             db.session.add(upload)
+            db.session.flush()
+            store_unique_file(upload, file.stream.read())
             uploads.append(upload)
         db.session.commit()
 
@@ -57,7 +109,7 @@ class ChallengeFiles(Resource):
         files = UniqueChallengeFiles.query.filter_by(challenge_id=challenge_id).all()
         return {
             "success": True,
-            "data": [dict(name=f.name, id=f.id) for f in files]
+            "data": [dict(name=f.name, id=f.id, size=f.size, placeholders=f.placeholder_count) for f in files]
         }
 
 @API_NAMESPACE.route("/files/<challenge_id>/<file_id>")
@@ -75,18 +127,14 @@ class ChallengeFile(Resource):
         challenge = UniqueChallenges.query.filter_by(id=challenge_id).first_or_404()
         file = (UniqueChallengeFiles.query.filter_by(challenge_id=challenge_id, id=file_id)
                 .first_or_404())
-        return send_file(
-            io.BytesIO(get_unique_challenge_file(challenge, file.content)),
-            attachment_filename=file.name,
-            as_attachment=True,
-            mimetype='application/octet-stream'
-        )
+        return send_download(get_unique_challenge_file(challenge, file, request.if_none_match), file.name)
 
     @admins_only
     def delete(self, challenge_id, file_id):
         """ Handle the delete request """
-        UniqueChallengeFiles.query.filter_by(challenge_id=challenge_id, id=file_id).delete()
+        unused = delete_unique_files(UniqueChallengeFiles.query.filter_by(challenge_id=challenge_id, id=file_id))
         db.session.commit()
+        remove_content(unused)
         return {"success": True}
 
 
@@ -101,15 +149,17 @@ class GeneratedFiles(Resource):
         if data.get('id'):
             script = UniqueChallengeScript.query.filter_by(id=data.get('id')).one()
             script.name = data.get('name')
-            script.script = bytes(data.get('script'), 'utf-8')
         else:
             script = UniqueChallengeScript(
                 name=data.get('name'),
-                script=bytes(data.get('script'), 'utf-8'),
                 challenge_id=challenge_id
             )
             db.session.add(script)
+        script.script = bytes(data.get('script'), 'utf-8')
+        script.sha256 = hashlib.sha256(script.script).hexdigest()
+        script.deterministic = bool(data.get('deterministic'))
         db.session.commit()
+        invalidate_script(script.id)
 
         return {
             "success": True,
@@ -145,13 +195,15 @@ class GeneratedChallengeFile(Resource):
         challenge = UniqueChallenges.query.filter_by(id=challenge_id).first_or_404()
         file = (UniqueChallengeScript.query.filter_by(challenge_id=challenge_id, id=file_id)
                 .first_or_404())
-        return dict(success=True, name=file.name, script=file.script.decode('utf-8'), id=file.id)
+        return dict(success=True, name=file.name, script=file.script.decode('utf-8'), id=file.id,
+                    deterministic=bool(file.deterministic))
 
     @admins_only
     def delete(self, challenge_id, file_id):
         """ Handle the delete request """
         UniqueChallengeScript.query.filter_by(challenge_id=challenge_id, id=file_id).delete()
         db.session.commit()
+        invalidate_script(file_id)
         return {"success": True}
 
 @API_NAMESPACE.route("/generated-files/<challenge_id>/<file_id>/download")
@@ -168,12 +220,8 @@ class GeneratedChallengeFileDownload(Resource):
         challenge = UniqueChallenges.query.filter_by(id=challenge_id).first_or_404()
         file = (UniqueChallengeScript.query.filter_by(challenge_id=challenge_id, id=file_id)
                 .first_or_404())
-        return send_file(
-            io.BytesIO(get_generated_challenge_file(challenge, file.script.decode('utf-8'))),
-            attachment_filename=file.name,
-            as_attachment=True,
-            mimetype='application/octet-stream'
-        )
+        download = get_generated_challenge_file(challenge, file, request.if_none_match)
+        return send_download(download, file.name, weak=not file.deterministic)
 
 @API_NAMESPACE.route("/requirements/<challenge_id>")
 @API_NAMESPACE.param("challenge_id", "A challenge ID")
@@ -205,7 +253,9 @@ class UniqueChallengeRequirementsResource(Resource):
             except LispIshParseError as error:
                 return dict(status='error', error=str(error))
         requirement.script = bytes(script, 'utf-8')
+        save_requirement_dependencies(challenge_id, script)
         db.session.commit()
+        invalidate_requirements(challenge_id)
         return dict(status='ok', script=requirement.script.decode('utf-8'))
 
 @API_NAMESPACE.route("/config")
@@ -214,81 +264,123 @@ class UniqueChallengesConfig(Resource):
     def post(self):
         data = request.form or request.get_json()
         set_config("unique_challenges_filter_list", bool(data.get("filter_list")))
+        if data.get("flag_mode") in ("stored", "derived"):
+            set_flag_mode(data.get("flag_mode"))
         return dict(status='ok')
 
+@API_NAMESPACE.route("/flags/provision")
+class ProvisionFlags(Resource):
+    """ Allows admins to create every missing unique flag ahead of time. """
+    @admins_only
+    def get(self):
+        """ Get the progress of the current or last provisioning """
+        return dict(status='ok', provisioning=flag_provisioning_status())
+
+    @admins_only
+    def post(self):
+        """ Start creating flags in the background, optionally limited to a single challenge """
+        data = request.form or request.get_json() or {}
+        challenge_id = data.get('challenge')
+        if not start_flag_provisioning([challenge_id] if challenge_id else None):
+            return dict(status='error', error='Flags are already being created')
+        return dict(status='ok', provisioning=flag_provisioning_status())
+
+@API_NAMESPACE.route("/generated-files/warm-up")
+class GeneratedFilesWarmUp(Resource):
+    """ Allows admins to run deterministic scripts for every user ahead of time. """
+    @admins_only
+    def get(self):
+        """ Get the progress of the current or last warm up """
+        return dict(status='ok', warmup=generated_file_warmup_status())
+
+    @admins_only
+    def post(self):
+        """ Start a warm up in the background, optionally limited to a single script """
+        data = request.form or request.get_json() or {}
+        script_id = data.get('script')
+        if not start_generated_file_warmup([script_id] if script_id else None):
+            return dict(status='error', error='A warm up is already running')
+        return dict(status='ok', warmup=generated_file_warmup_status())
+
 @API_NAMESPACE.route("/audit")
 class AuditList(Resource):
-    """ Provides a list of users along with high level audit info. """
+    """ Provides a page of audit findings along with the names of the users and teams involved.
+    Accepts sort (challenge, submit or copied), cursor, limit, and challenge, user, team and cohort filters.
+    The audit field holds the progress of the audit update, findings for recent submissions may be missing
+    while it is running.
+    """
     @admins_only
     def get(self):
-        # First get all submissions that are suspect. These are submissions which
-        # include a unique flag for that challenge but are marked incorrect.
-        # TODO: SQLAlchemy surely has some way to represent this via the query builder
-        # but I gave up and just used text after an hour banging my head against it...
-        statement = text("""
-            SELECT s.challenge_id, s.id, s.user_id, s.team_id, uf.user_id as ufuid, uf.team_id as uftid FROM submissions AS s
-            JOIN unique_flags AS uf
-                ON uf.challenge_id = s.challenge_id
-                WHERE type = "incorrect"
-                AND (
-                    INSTR(s.provided, uf.flag_8)
-                    OR INSTR(s.provided, uf.flag_16)
-                    OR INSTR(s.provided, uf.flag_32)
-                )
-                AND (
-                    (uf.user_id IS NULL OR uf.user_id <> s.user_id)
-                    AND (uf.team_id IS NULL OR uf.team_id <> s.team_id)
-                )
-        """)
-        # NOTE: We request specific columns here instead of the Submissions/UniqueFlags object because
-        # SQLAlchemy dedupes - https://docs.sqlalchemy.org/en/13/faq/sessions.html#faq-query-deduplicating
-        query = db.session.query(
-            Submissions.challenge_id, Submissions.id,
-            Submissions.user_id, Submissions.team_id,
-            UniqueFlags.user_id.label('ufuid'), UniqueFlags.team_id.label('uftid')
-        ).from_statement(statement)
-
-        suspect = []
-        users = set()
-        teams = set()
-        for (c_id, sub_id, sub_uid, sub_tid, uf_uid, uf_tid) in query:
-            users.add(sub_uid)
-            users.add(uf_uid)
-            teams.add(sub_tid)
-            teams.add(uf_tid)
-
-            challenge = UniqueChallenges.query.filter_by(id=c_id).one()
-            suspect.append(dict(
-                challenge_id=challenge.id,
-                submission_id=sub_id,
-                challenge_name=challenge.name,
-                team_id=sub_tid,
-                source_team=uf_tid,
-                user_id=sub_uid,
-                source_user=uf_uid
-            ))
+        # Findings are submissions which include another account's unique flag for that challenge but are
+        # marked incorrect. Submissions made since the last audit are checked in the background, only when
+        # the first page is loaded so that findings don't change while later pages are being read.
+        args = request.args
+        audit = audit_status() if args.get('cursor') else request_audit_update()
+        try:
+            rows, cursor = audit_findings_page(
+                sort=args.get('sort', 'challenge'),
+                cursor=args.get('cursor'),
+                limit=min(max(args.get('limit', 100, type=int), 1), 250),
+                challenge_id=args.get('challenge', type=int),
+                user_id=args.get('user', type=int),
+                team_id=args.get('team', type=int),
+                cohort_id=args.get('cohort', type=int)
+            )
+        except ValueError as error:
+            return dict(status='error', error=str(error))
+
+        suspect = [
+            dict(
+                challenge_id=finding.challenge_id,
+                submission_id=finding.submission_id,
+                challenge_name=challenge_name,
+                team_id=finding.team_id,
+                source_team=finding.source_team_id,
+                user_id=finding.user_id,
+                source_user=finding.source_user_id
+            )
+            for (finding, challenge_name) in rows
+        ]
 
+        # Only the accounts on this page are needed, so this is bounded by the page size.
+        user_ids = {s['user_id'] for s in suspect} | {s['source_user'] for s in suspect}
+        user_ids.discard(None)
         users_arr = []
-        for user in users:
-            if user is None:
-                continue
-            db_user = Users.query.filter_by(id=user).one()
-            users_arr.append(dict(id=db_user.id, name=db_user.name))
+        if user_ids:
+            users = Users.query.with_entities(Users.id, Users.name).filter(Users.id.in_(user_ids))
+            users_arr = [dict(id=user_id, name=name) for (user_id, name) in users]
 
+        team_ids = {s['team_id'] for s in suspect} | {s['source_team'] for s in suspect}
+        team_ids.discard(None)
         teams_arr = []
-        for team in teams:
-            if team is None:
-                continue
-            db_team = Teams.query.filter_by(id=team).one()
-            teams_arr.append(dict(id=db_team.id, name=db_team.name))
+        if team_ids:
+            teams = Teams.query.with_entities(Teams.id, Teams.name).filter(Teams.id.in_(team_ids))
+            teams_arr = [dict(id=team_id, name=name) for (team_id, name) in teams]
 
         return dict(
             status='ok',
             suspect=suspect,
             users=users_arr,
-            teams=teams_arr
+            teams=teams_arr,
+            next=cursor,
+            audit=audit
         )
 
+@API_NAMESPACE.route("/audit/rebuild")
+class AuditRebuild(Resource):
+    """ Allows admins to discard every audit finding and audit every submission again. """
+    @admins_only
+    def get(self):
+        """ Get the progress of the current or last audit update """
+        return dict(status='ok', audit=audit_status())
+
+    @admins_only
+    def post(self):
+        """ Start auditing every submission again in the background """
+        if not start_audit_update(rebuild=True):
+            return dict(status='error', error='The audit is already being updated')
+        return dict(status='ok', audit=audit_status())
+
 @API_NAMESPACE.route("/cohorts")
 class Cohorts(Resource):
     @admins_only
@@ -308,6 +400,7 @@ class Cohorts(Resource):
         cohort = UniqueChallengeCohort(name=name)
         db.session.add(cohort)
         db.session.commit()
+        bump_requirement_versions('global')
         return dict(status='ok', id=cohort.id)
 
     @admins_only
@@ -316,6 +409,7 @@ class Cohorts(Resource):
         UniqueChallengeCohort.query.filter_by(id=data.get('id')).delete()
         UniqueChallengeCohortMembership.query.filter_by(cohort_id=data.get('id')).delete()
         db.session.commit()
+        bump_requirement_versions('global')
         return dict(status='ok')
 
 
@@ -338,6 +432,7 @@ class Cohorts(Resource):
         membership = UniqueChallengeCohortMembership(user_id=user_id, cohort_id=cohort_id)
         db.session.add(membership)
         db.session.commit()
+        bump_requirement_versions(f'user_{user_id}')
         return dict(status='ok', id=membership.id)
 
     @admins_only
@@ -345,4 +440,5 @@ class Cohorts(Resource):
         data = request.form or request.get_json()
         UniqueChallengeCohortMembership.query.filter_by(user_id=data.get('user_id'), cohort_id=data.get('cohort_id')).delete()
         db.session.commit()
+        bump_requirement_versions(f"user_{data.get('user_id')}")
         return dict(status='ok')
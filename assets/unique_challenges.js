@@ -19,6 +19,196 @@ $('#unique_challenges_config_form').submit(function(event) {
     })
 })
 
+/**
+ * @param {{ running: boolean, checked: number, total: number | null, created: number,
+ *   error: string | null } | null} provisioning
+ */
+function showProvisioning(provisioning) {
+    if (!provisioning) return
+    $('#provision_form_submit').prop('disabled', provisioning.running)
+    if (provisioning.total === null) {
+        $('#provision_result').text('Starting...')
+    } else {
+        $('#provision_result').text(
+            (provisioning.running ? 'Creating flags: ' : 'Finished: ') + 'created ' + provisioning.created +
+            ' flags, checked ' + provisioning.checked + '/' + provisioning.total + ' challenge/account pairs.' +
+            (provisioning.error ? ' Error: ' + provisioning.error : '')
+        )
+    }
+    if (provisioning.running) {
+        setTimeout(loadProvisioning, 2000)
+    }
+}
+
+function loadProvisioning() {
+    $.ajax({
+        url: CTFd.config.urlRoot + "/api/unique/flags/provision",
+        success: function(result) {
+            showProvisioning(result.provisioning)
+        }
+    })
+}
+loadProvisioning()
+
+$('#unique_challenges_provision_form').submit(function(event) {
+    event.preventDefault()
+    const form = event.target
+    const data = new FormData(/** @type {any} */ (form))
+    $('#provision_form_submit').prop('disabled', true)
+    $.post({
+        url: CTFd.config.urlRoot + "/api/unique/flags/provision",
+        data: data,
+        cache: false,
+        contentType: false,
+        processData: false,
+        success: function(result) {
+            if (result.status === 'error') {
+                $('#provision_result').text(result.error)
+                $('#provision_form_submit').prop('disabled', false)
+            } else {
+                showProvisioning(result.provisioning)
+            }
+        }
+    })
+})
+
+/**
+ * @typedef {object} WarmUpScript
+ * @property {string} name
+ * @property {number} runs
+ * @property {number} failures
+ * @property {number} seconds
+ * @property {number} max_seconds
+ */
+
+/**
+ * @param {{ running: boolean, total?: number, done?: number, cached?: number, failed?: number,
+ *   error?: string | null, scripts?: Record<string, WarmUpScript> } | null} warmup
+ */
+function showWarmUp(warmup) {
+    if (!warmup) return
+    $('#warmup_form_submit').prop('disabled', warmup.running)
+    if (warmup.total === undefined) {
+        $('#warmup_result').text('Starting...')
+    } else {
+        $('#warmup_result').text(
+            (warmup.running ? 'Running: ' : 'Finished: ') + warmup.done + '/' + warmup.total + ' files, ' +
+            warmup.cached + ' already cached, ' + warmup.failed + ' failed.' +
+            (warmup.error ? ' Error: ' + warmup.error : '')
+        )
+    }
+
+    const body = $('#warmup_scripts tbody').empty()
+    for (const script of Object.values(warmup.scripts || {})) {
+        const mean = script.runs ? script.seconds / script.runs : 0
+        const row = $('<tr>')
+        row.append($('<td>').text(script.name))
+        row.append($('<td class="text-center">').text(script.runs))
+        row.append($('<td class="text-center">').text(script.failures))
+        row.append($('<td class="text-center">').text(mean.toFixed(3) + 's'))
+        row.append($('<td class="text-center">').text(script.max_seconds.toFixed(3) + 's'))
+        body.append(row)
+    }
+    $('#warmup_scripts').toggleClass('d-none', !warmup.scripts)
+
+    if (warmup.running) {
+        setTimeout(loadWarmUp, 2000)
+    }
+}
+
+function loadWarmUp() {
+    $.ajax({
+        url: CTFd.config.urlRoot + "/api/unique/generated-files/warm-up",
+        success: function(result) {
+            showWarmUp(result.warmup)
+        }
+    })
+}
+loadWarmUp()
+
+$('#unique_challenges_warmup_form').submit(function(event) {
+    event.preventDefault()
+    const form = event.target
+    const data = new FormData(/** @type {any} */ (form))
+    $('#warmup_form_submit').prop('disabled', true)
+    $.post({
+        url: CTFd.config.urlRoot + "/api/unique/generated-files/warm-up",
+        data: data,
+        cache: false,
+        contentType: false,
+        processData: false,
+        success: function(result) {
+            if (result.status === 'error') {
+                $('#warmup_result').text(result.error)
+                $('#warmup_form_submit').prop('disabled', false)
+            } else {
+                showWarmUp(result.warmup)
+            }
+        }
+    })
+})
+
+/**
+ * @param {{ running: boolean, rebuild?: boolean, total?: number | null, checked?: number, found?: number,
+ *   error?: string | null } | null} audit
+ */
+function showAudit(audit) {
+    if (!audit) return
+    $('#audit_rebuild_submit').prop('disabled', audit.running)
+    if (audit.running) {
+        $('#audit_rebuild_result').text(
+            (audit.rebuild ? 'Re-auditing all submissions' : 'Auditing new submissions') +
+            (audit.total ? ': ' + audit.checked + '/' + audit.total + ' challenges' : '') +
+            '. Results may be incomplete until this finishes.'
+        )
+        if (!auditPolling) {
+            auditPolling = true
+            setTimeout(loadAudit, 2000)
+        }
+    } else {
+        $('#audit_rebuild_result').text(audit.error ? 'Error: ' + audit.error : '')
+    }
+}
+
+/** Set while waiting for an audit update to finish, so that only one poll is scheduled. */
+let auditPolling = false
+
+function loadAudit() {
+    $.ajax({
+        url: CTFd.config.urlRoot + "/api/unique/audit/rebuild",
+        success: function(result) {
+            auditPolling = false
+            showAudit(result.audit)
+            if (result.audit && !result.audit.running) {
+                rebuildAudit()
+            }
+        }
+    })
+}
+
+$('#audit_rebuild_form').submit(function(event) {
+    event.preventDefault()
+    const form = event.target
+    const data = new FormData(/** @type {any} */ (form))
+    $('#audit_rebuild_submit').prop('disabled', true)
+    $.post({
+        url: CTFd.config.urlRoot + "/api/unique/audit/rebuild",
+        data: data,
+        cache: false,
+        contentType: false,
+        processData: false,
+        success: function(result) {
+            if (result.status === 'error') {
+                $('#audit_rebuild_result').text(result.error)
+                $('#audit_rebuild_submit').prop('disabled', false)
+            } else {
+                showAudit(result.audit)
+                rebuildAudit()
+            }
+        }
+    })
+})
+
 /**
  * @typedef {object} Suspect
  * @property {number} challenge_id
@@ -29,98 +219,74 @@ $('#unique_challenges_config_form').submit(function(event) {
  * @property {number | null} source_team
  */
 
-/** @type {Suspect[]} */
-let suspects = []
 /** @type {Map<number, string>} */
 const users = new Map()
 /** @type {Map<number, string>} */
 const teams = new Map()
+/** @type {string | null} */
+let auditCursor = null
+/** Incremented whenever the grouping or filters change, so responses for older pages are ignored. */
+let auditGeneration = 0
+
+const template = $(/** @type {HTMLTemplateElement} */($('#suspect-info')[0]).content)
 
 $.ajax({
-    url: CTFd.config.urlRoot + "/api/unique/audit",
-    success: function (data) {
-        suspects = data.suspect
-        for (const user of data.users) {
-            users.set(user.id, user.name)
+    url: CTFd.config.urlRoot + "/api/unique/cohorts",
+    success: function(data) {
+        for (const cohort of data.cohorts) {
+            $('#audit-cohort').append($('<option>').val(cohort.id).text(cohort.name))
         }
-        for (const team of data.teams) {
-            teams.set(team.id, team.name)
-        }
-        rebuildAudit()
     }
 })
 
-/**
- * @template T
- * @typedef Sorter
- * @property {(a: T, b: T) => number} run
- * @property {(fn: (a: T, b: T) => boolean) => Sorter<T>} thenBy
- */
+$('#audit-grouping, #audit-challenge, #audit-user, #audit-team, #audit-cohort').change(rebuildAudit)
+$('#audit-more').click(loadAuditPage)
+rebuildAudit()
 
-/**
- * Simple sort helper because I find sort predicates that return a boolean easier to reason about.
- * @template T
- * @param {(a: T, b: T) => boolean} fn
- * @returns {Sorter<T>}
- */
-function sort(fn) {
-    return {
-        run: function(a, b) {
-            if (fn(a, b)) {
-                return -1
-            }
-            if (fn(b, a)) {
-                return 1
-            }
-            return 0
-        },
-        thenBy: function(next) {
-            return sort(function (a, b) {
-                if (fn(a, b)) {
-                    return true
-                }
-                if (fn(b, a)) {
-                    return false
-                }
-                return next(a, b)
-            })
-        }
-    }
+function rebuildAudit() {
+    auditGeneration++
+    auditCursor = null
+    $('#auditing tbody').children().remove()
+    loadAuditPage()
 }
 
-/** @type {Record<string, Sorter<Suspect>>} */
-const sorters = {
-    challenge: sort(function (a, b) {
-        return a.challenge_name < b.challenge_name
-    }).thenBy(function (a, b) {
-        return users.get(a.user_id) < users.get(b.user_id)
-    }),
-    submit: sort(function(a, b) {
-        if (a.team_id != null) {
-            return teams.get(a.team_id) < teams.get(b.team_id)
+/** Fetches the next page of audit events, sorted and filtered by the server. */
+function loadAuditPage() {
+    const generation = auditGeneration
+    /** @type {Record<string, any>} */
+    const params = { sort: $('#audit-grouping').val() }
+    for (const filter of ['challenge', 'user', 'team', 'cohort']) {
+        const value = $('#audit-' + filter).val()
+        if (value) {
+            params[filter] = value
         }
-        return users.get(a.user_id) < users.get(b.user_id)
-    }).thenBy(function(a, b) {
-        return a.challenge_name < b.challenge_name
-    }),
-    copied: sort(function(a, b) {
-        if (a.source_team != null) {
-            return teams.get(a.source_team) < teams.get(b.source_team)
+    }
+    if (auditCursor) {
+        params.cursor = auditCursor
+    }
+
+    $('#audit-more').prop('disabled', true)
+    $.ajax({
+        url: CTFd.config.urlRoot + "/api/unique/audit",
+        data: params,
+        success: function (data) {
+            if (generation !== auditGeneration) return
+            for (const user of data.users) {
+                users.set(user.id, user.name)
+            }
+            for (const team of data.teams) {
+                teams.set(team.id, team.name)
+            }
+            auditCursor = data.next
+            showAudit(data.audit)
+            appendSuspects(data.suspect || [])
+            $('#audit-more').toggleClass('d-none', !data.next).prop('disabled', false)
         }
-        return false // Sort by users
-    }).thenBy(function(a, b) {
-        return users.get(a.source_user) < users.get(b.source_user)
     })
 }
 
-const template = $(/** @type {HTMLTemplateElement} */($('#suspect-info')[0]).content)
-
-$('#audit-grouping').change(rebuildAudit)
-function rebuildAudit() {
-    const sorter = /** @type {string} */ ($('#audit-grouping').val())
-    suspects.sort(sorters[sorter].run)
-
-    $('#auditing tbody').children().remove()
+/** @param {Suspect[]} suspects */
+function appendSuspects(suspects) {
     for (const suspect of suspects) {
         const sTempl = template.clone()
         sTempl.find('[data-text="chal"]')
@@ -140,7 +306,7 @@ function rebuildAudit() {
             .text(teams.get(suspect.source_team))
         $('#auditing tbody').append(sTempl)
     }
-    if (!suspects.length) {
+    if (!$('#auditing tbody').children().length) {
         $('#auditing tbody').append('No audit events found.')
     }
 }
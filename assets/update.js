@@ -69,6 +69,14 @@ $('#nav-tabContent').append(`
                             Output to standard out will be presented to the user as a file.
                         </sub>
                     </div>
+                    <div class="form-group form-check">
+                        <input type="checkbox" class="form-check-input" name="deterministic" id="script-file-deterministic">
+                        <label class="form-check-label" for="script-file-deterministic">Deterministic</label>
+                        <small class="form-text text-muted">
+                            Check this if the script always prints the same output for the same placeholders.
+                            Its output will be cached instead of running the script for every download.
+                        </small>
+                    </div>
                     <div class="form-group">
                         <button class="btn btn-success float-right" id="submit-script-files">Create</button>
                         <input type="hidden" name="id" id="script-file-id">
@@ -197,6 +205,7 @@ $('#nav-tabContent').append(`
         editor.setValue('', 1)
         $('#script-file-id').val('')
         $('#script-file-name').val('')
+        $('#script-file-deterministic').prop('checked', false)
         $('#submit-script-files').text('Create')
     }
 
@@ -219,6 +228,7 @@ $('#nav-tabContent').append(`
                         editor.setValue(response.script || '', 1)
                         $('#script-file-name').val(response.name)
                         $('#script-file-id').attr('value', response.id)
+                        $('#script-file-deterministic').prop('checked', response.deterministic)
                         $('#submit-script-files').text('Update')
                     }
                 })
@@ -252,7 +262,8 @@ $('#nav-tabContent').append(`
                 challenge: CHALLENGE_ID,
                 id: $('#script-file-id').val(),
                 name: $('#script-file-name').val(),
-                script: editor.getValue()
+                script: editor.getValue(),
+                deterministic: $('#script-file-deterministic').is(':checked') ? 'on' : ''
             },
             success: function(response) {
                 if (response.created) {
@@ -0,0 +1,129 @@
+"""
+Compares the inverted-index audit in audit.py with the INSTR join the audit endpoint used to run,
+using SQLite with synthetic flags and submissions. The join is slow enough that by default it is only
+run for a sample of challenges and its total time is extrapolated. Results are checked to match.
+
+Usage: python benchmarks/audit_bench.py [--users N] [--challenges N] [--submissions N] [--sql-challenges N]
+"""
+import sys
+import time
+import random
+import sqlite3
+import argparse
+from collections import defaultdict
+from os.path import join, dirname, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+
+from audit import audit_challenge
+
+# SQLite's INSTR is case-sensitive, so both sides are lowered to match MySQL's default collation.
+AUDIT_SQL = """
+    SELECT s.challenge_id, s.id, s.user_id, s.team_id, uf.user_id as ufuid, uf.team_id as uftid FROM submissions AS s
+    JOIN unique_flags AS uf
+        ON uf.challenge_id = s.challenge_id
+        WHERE type = "incorrect"
+        AND (
+            INSTR(LOWER(s.provided), LOWER(uf.flag_8))
+            OR INSTR(LOWER(s.provided), LOWER(uf.flag_16))
+            OR INSTR(LOWER(s.provided), LOWER(uf.flag_32))
+        )
+        AND (
+            (uf.user_id IS NULL OR uf.user_id <> s.user_id)
+            AND (uf.team_id IS NULL OR uf.team_id <> s.team_id)
+        )
+"""
+
+
+def generate(rng, users, challenges, submissions_per_user):
+    """ Creates a database of flags for every user on every challenge and incorrect submissions,
+    a few of which contain another user's flag. """
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE unique_flags (id INTEGER PRIMARY KEY, challenge_id INTEGER, user_id INTEGER, "
+                 "team_id INTEGER, flag_8 TEXT, flag_16 TEXT, flag_32 TEXT)")
+    conn.execute("CREATE INDEX unique_flags_challenge ON unique_flags (challenge_id)")
+    conn.execute("CREATE TABLE submissions (id INTEGER PRIMARY KEY, challenge_id INTEGER, user_id INTEGER, "
+                 "team_id INTEGER, provided TEXT, type TEXT)")
+
+    def token(length):
+        return f"{rng.getrandbits(length * 4):0{length}x}"
+
+    flags = {}
+    for challenge_id in range(1, challenges + 1):
+        rows = []
+        for user_id in range(1, users + 1):
+            flag = (challenge_id, user_id, None, token(8), token(16), token(32))
+            flags[challenge_id, user_id] = flag
+            rows.append(flag)
+        conn.executemany("INSERT INTO unique_flags (challenge_id, user_id, team_id, flag_8, flag_16, flag_32) "
+                         "VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    rows = []
+    for user_id in range(1, users + 1):
+        for _ in range(submissions_per_user):
+            challenge_id = rng.randint(1, challenges)
+            if rng.random() < 0.05:
+                source = flags[challenge_id, rng.randint(1, users)]
+                provided = f"flag{{{source[rng.randint(3, 5)]}}}"
+                if rng.random() < 0.25:
+                    provided = provided.upper()
+            else:
+                provided = rng.choice([f"flag{{{token(rng.choice([8, 16, 32]))}}}", "no idea", token(40)])
+            rows.append((challenge_id, user_id, None, provided, "incorrect"))
+    conn.executemany("INSERT INTO submissions (challenge_id, user_id, team_id, provided, type) "
+                     "VALUES (?, ?, ?, ?, ?)", rows)
+    return conn
+
+
+def run_index(conn, challenge_ids):
+    """ Runs the audit the way helpers.find_flag_leaks does, one challenge at a time """
+    results = []
+    for challenge_id in challenge_ids:
+        flags = conn.execute("SELECT challenge_id, user_id, team_id, flag_8, flag_16, flag_32 FROM unique_flags "
+                             "WHERE challenge_id = ?", (challenge_id,)).fetchall()
+        submissions = conn.execute("SELECT challenge_id, id, user_id, team_id, provided FROM submissions "
+                                   "WHERE challenge_id = ? AND type = 'incorrect'", (challenge_id,)).fetchall()
+        results.extend(audit_challenge(flags, submissions))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--challenges', type=int, default=100)
+    parser.add_argument('--submissions', type=int, default=5, help="Incorrect submissions per user")
+    parser.add_argument('--sql-challenges', type=int, default=3,
+                        help="Number of challenges to run the INSTR join for, 0 for all")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    conn = generate(random.Random(1), args.users, args.challenges, args.submissions)
+    print(f"Generated {args.users} users x {args.challenges} challenges, "
+          f"{args.users * args.submissions} submissions in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    index_rows = run_index(conn, range(1, args.challenges + 1))
+    index_time = time.perf_counter() - start
+    print(f"Inverted index: {index_time:.2f}s, {len(index_rows)} suspect submissions")
+
+    sample = args.sql_challenges or args.challenges
+    sample_ids = list(range(1, sample + 1))
+    start = time.perf_counter()
+    sql_rows = conn.execute(
+        AUDIT_SQL.replace('WHERE type', f"WHERE s.challenge_id IN ({','.join(map(str, sample_ids))}) AND type")
+    ).fetchall()
+    sql_time = time.perf_counter() - start
+
+    by_challenge = defaultdict(list)
+    for row in index_rows:
+        by_challenge[row[0]].append(row)
+    expected = sorted(row for challenge_id in sample_ids for row in by_challenge[challenge_id])
+    assert sorted(sql_rows) == expected, "Inverted index results differ from the INSTR join"
+
+    estimate = sql_time * args.challenges / sample
+    print(f"INSTR join: {sql_time:.2f}s for {sample} challenges, "
+          f"{'' if sample == args.challenges else 'estimated '}{estimate:.1f}s for all, results match")
+    print(f"Speedup: {estimate / index_time:.0f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Compares tree-walking evaluation of LispIsh requirement scripts with compiled evaluation.
+
+Usage: python benchmarks/lispish_bench.py [iterations]
+"""
+import sys
+import time
+import timeit
+from os.path import join, dirname, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+
+from lispish import LispIsh
+
+# Mirrors the scripts in create_test_data.py
+SCRIPTS = {
+    'score': """(>=
+        (user-score)
+        10)""",
+    'dates': """(or
+        (before "2020-05-16")
+        (after "2020-05-20"))""",
+    'cohorts': """(and
+        (or (cohort "CS 123") (cohort "CS 456"))
+        (completed 1 2))""",
+    'names': """(or
+        (= (user-name) 'alice')
+        (= (user-name) 'Alice')
+        (= (user-name) 'bob')
+        (= (user-name) 'Bob')
+        (= (user-name) 'eve')
+        (= (user-name) 'Eve'))""",
+}
+
+SOLVED = {1, 2, 5}
+COHORTS = {'CS 456'}
+
+def _before(arg):
+    return time.time() < time.mktime(time.strptime(arg[0], "%Y-%m-%d"))
+
+FUNCTIONS = {
+    'COMPLETED': lambda arg: all(a in SOLVED for a in arg),
+    'COHORT': lambda arg: all(a in COHORTS for a in arg),
+    'BEFORE': _before,
+    'AFTER': lambda arg: not _before(arg),
+    'USER-EMAIL': lambda _: 'eve@fake-email.fake',
+    'USER-NAME': lambda _: 'Eve',
+    'USER-ID': lambda _: 12,
+    'USER-SCORE': lambda _: 23,
+}
+
+# Mirrors helpers.REQUIREMENT_FUNCTIONS
+COSTS = {
+    'USER-EMAIL': 1,
+    'USER-NAME': 1,
+    'USER-ID': 1,
+    'BEFORE': 2,
+    'AFTER': 2,
+    'COMPLETED': 10,
+    'COHORT': 10,
+    'USER-SCORE': 10,
+}
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    lisp = LispIsh()
+    print(f"{'script':<10} {'parse+walk':>12} {'walk':>12} {'compiled':>12} {'speedup':>8}  (us per evaluation)")
+    for name, script in SCRIPTS.items():
+        method = lisp.parse(script)
+        program = lisp.compile(method, FUNCTIONS, COSTS)
+        assert method.evaluate(FUNCTIONS) == program(FUNCTIONS)
+
+        parse_walk = timeit.timeit(lambda: LispIsh().parse(script).evaluate(FUNCTIONS), number=number // 10) * 10
+        walk = timeit.timeit(lambda: method.evaluate(FUNCTIONS), number=number)
+        compiled = timeit.timeit(lambda: program(FUNCTIONS), number=number)
+        print(f"{name:<10} {parse_walk / number * 1e6:>12.2f} {walk / number * 1e6:>12.2f} "
+              f"{compiled / number * 1e6:>12.2f} {walk / compiled:>7.2f}x")
+
+if __name__ == '__main__':
+    main()
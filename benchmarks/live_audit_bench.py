@@ -0,0 +1,100 @@
+"""
+Measures what checking incorrect submissions for other accounts' flags as they are made adds to an attempt.
+Each submission is compared with the cost of recording it, an INSERT and COMMIT to an SQLite file, which
+is what every incorrect attempt already does. Results are checked against audit_challenge.
+
+Building an index is reported separately, along with its memory use. Indexes are built in a background
+thread, so building never adds to an attempt, but the time shows how long submissions to a challenge
+go unchecked by a newly started worker.
+
+Usage: python benchmarks/live_audit_bench.py [--users N] [--submissions N]
+"""
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import tracemalloc
+from os.path import join, dirname, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+
+from audit import AccountFlagIndex, audit_challenge
+from audit_bench import generate
+
+
+def build(flags):
+    """ Indexes copies of the flags, so the strings measured belong to the index as they would in the plugin """
+    index = AccountFlagIndex()
+    for flag in flags:
+        index.add(tuple(''.join(value) if isinstance(value, str) else value for value in flag))
+    return index
+
+
+def record(conn, rows, index=None):
+    """ Inserts and commits each submission, checking it with the index first if one is given """
+    found = []
+    start = time.perf_counter()
+    for (challenge_id, sub_id, sub_uid, sub_tid, provided) in rows:
+        conn.execute("INSERT INTO fails (challenge_id, user_id, team_id, provided) VALUES (?, ?, ?, ?)",
+                     (challenge_id, sub_uid, sub_tid, provided))
+        if index is not None:
+            for (flag_uid, flag_tid) in index.sources(provided, sub_uid, sub_tid):
+                found.append((challenge_id, sub_id, sub_uid, sub_tid, flag_uid, flag_tid))
+        conn.commit()
+    return time.perf_counter() - start, found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--submissions', type=int, default=2, help="Incorrect submissions per user")
+    args = parser.parse_args()
+
+    source = generate(random.Random(1), args.users, 1, args.submissions)
+    flags = source.execute("SELECT challenge_id, user_id, team_id, flag_8, flag_16, flag_32 FROM unique_flags").fetchall()
+    rows = source.execute("SELECT challenge_id, id, user_id, team_id, provided FROM submissions").fetchall()
+
+    start = time.perf_counter()
+    index = build(flags)
+    elapsed = time.perf_counter() - start
+    # Built again to measure memory, since tracing slows building down.
+    tracemalloc.start()
+    measured = build(flags)
+    used = tracemalloc.get_traced_memory()[0]
+    del measured
+    tracemalloc.stop()
+    print(f"Indexed {len(index)} flag rows in {elapsed * 1000:.0f}ms, using {used / 2 ** 20:.1f} MiB "
+          f"(estimated {index.approximate_bytes() / 2 ** 20:.1f} MiB)")
+
+    with tempfile.TemporaryDirectory() as directory:
+        conn = sqlite3.connect(os.path.join(directory, 'bench.db'))
+        conn.execute("CREATE TABLE fails (id INTEGER PRIMARY KEY, challenge_id INTEGER, user_id INTEGER, "
+                     "team_id INTEGER, provided TEXT)")
+        # Warm up, then interleave runs so both see the same disk and cache state.
+        record(conn, rows[:100])
+        baseline, checked, found = 0.0, 0.0, []
+        for half in (rows[:len(rows) // 2], rows[len(rows) // 2:]):
+            baseline += record(conn, half)[0]
+            elapsed, leaks = record(conn, half, index)
+            checked += elapsed
+            found.extend(leaks)
+        conn.close()
+
+    assert sorted(found) == sorted(audit_challenge(flags, rows)), "Live results differ from audit_challenge"
+
+    start = time.perf_counter()
+    for (_, _, sub_uid, sub_tid, provided) in rows:
+        index.sources(provided, sub_uid, sub_tid)
+    lookup = time.perf_counter() - start
+
+    count = len(rows)
+    print(f"{'record':>10} {'+ check':>10} {'lookup':>10} {'overhead':>9}  (us per submission, {count} submissions)")
+    print(f"{baseline / count * 1e6:>10.1f} {checked / count * 1e6:>10.1f} {lookup / count * 1e6:>10.1f} "
+          f"{lookup / baseline * 100:>8.1f}%")
+    print(f"{len(found)} leaked flags found, results match")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Compares the per-download cost of running a generated file script from source, as every download
+used to, with running the cached code object.
+
+Usage: python benchmarks/scripts_bench.py [iterations]
+"""
+import sys
+import timeit
+from os.path import join, dirname, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+
+from scripts import CaptureExec, compile_script
+
+# Generates a web server log with the flag hidden in a request, similar to a typical forensics challenge.
+# Scripts run with separate globals and locals, so functions are passed everything they use.
+SCRIPT = """
+import random
+from datetime import datetime, timedelta
+
+rng = random.Random(PLACEHOLDERS['name'])
+
+PATHS = ['/', '/index.html', '/login', '/logout', '/static/app.js', '/static/style.css',
+         '/api/users', '/api/orders', '/admin', '/robots.txt', '/favicon.ico']
+AGENTS = [
+    'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/80.0 Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:75.0) Gecko/20100101 Firefox/75.0',
+    'curl/7.68.0',
+    'python-requests/2.23.0',
+]
+STATUSES = [200, 200, 200, 200, 301, 302, 304, 403, 404, 500]
+
+class Request:
+    def __init__(self, rng, when, ip, method, path, status, agent):
+        self.when = when
+        self.ip = ip
+        self.method = method
+        self.path = path
+        self.status = status
+        self.agent = agent
+        self.size = 0 if status in (301, 302, 304) else rng.randint(120, 40000)
+
+    def line(self):
+        stamp = self.when.strftime('%d/%b/%Y:%H:%M:%S +0000')
+        return f'{self.ip} - - [{stamp}] "{self.method} {self.path} HTTP/1.1" {self.status} {self.size} "-" "{self.agent}"'
+
+def random_ip(rng):
+    return '.'.join(str(rng.randint(1, 254)) for _ in range(4))
+
+def session(rng, start, ip, paths, agents, statuses):
+    from datetime import timedelta
+    agent = rng.choice(agents)
+    when = start
+    for _ in range(rng.randint(3, 12)):
+        when += timedelta(seconds=rng.randint(1, 90))
+        method = 'POST' if rng.random() < 0.1 else 'GET'
+        yield when, ip, method, rng.choice(paths), rng.choice(statuses), agent
+
+def encode(flag):
+    import hashlib
+    digest = hashlib.sha1(flag.encode()).hexdigest()[:8]
+    return ''.join(f'%{ord(c):02x}' for c in flag) + '&check=' + digest
+
+requests = []
+start = datetime(2020, 5, 1)
+for i in range(40):
+    for args in session(rng, start + timedelta(minutes=i * 7), random_ip(rng), PATHS, AGENTS, STATUSES):
+        requests.append(Request(rng, *args))
+
+leak = Request(rng, start + timedelta(hours=3), random_ip(rng), 'GET',
+               '/search?q=' + encode(PLACEHOLDERS['flag_32']), 200, AGENTS[2])
+requests.insert(rng.randrange(len(requests)), leak)
+requests.sort(key=lambda request: request.when)
+
+for request in requests:
+    print(request.line())
+"""
+
+PLACEHOLDERS = dict(flag_8='a' * 8, flag_16='b' * 16, flag_32='c' * 32, name='eve')
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    code = compile_script(1, SCRIPT)
+    assert 'ERROR' not in CaptureExec(code).run(dict(PLACEHOLDERS=PLACEHOLDERS))
+    assert CaptureExec(SCRIPT).run(dict(PLACEHOLDERS=PLACEHOLDERS)) == CaptureExec(code).run(dict(PLACEHOLDERS=PLACEHOLDERS))
+
+    compile_only = timeit.timeit(lambda: compile_script(1, SCRIPT), number=number)
+    source = timeit.timeit(lambda: CaptureExec(SCRIPT).run(dict(PLACEHOLDERS=PLACEHOLDERS)), number=number)
+    cached = timeit.timeit(lambda: CaptureExec(code).run(dict(PLACEHOLDERS=PLACEHOLDERS)), number=number)
+    print(f"{'compile':>12} {'from source':>12} {'cached code':>12} {'speedup':>8}  (us per download)")
+    print(f"{compile_only / number * 1e6:>12.1f} {source / number * 1e6:>12.1f} "
+          f"{cached / number * 1e6:>12.1f} {source / cached:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
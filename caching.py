@@ -0,0 +1,252 @@
+"""
+Contains the caches used by this plugin to avoid repeating expensive work.
+"""
+
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, BinaryIO, Callable, Hashable, Iterable, Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, where updates to a cache's size may race.
+    fcntl = None
+
+
+class LRUCache:
+    """ A thread safe, size bounded mapping which evicts the least recently used entry.
+
+    >>> cache = LRUCache(maxsize=2)
+    >>> cache.set('a', 1)
+    >>> cache.set('b', 2)
+    >>> cache.get('a')
+    1
+    >>> cache.set('c', 3)
+    >>> cache.get('b') is None
+    True
+    >>> cache.discard(lambda key: key == 'a')
+    >>> len(cache)
+    1
+
+    If sizeof is given, maxsize bounds the total sizeof of the values rather than their number.
+    The most recently set value is kept even if it is larger than maxsize on its own.
+
+    >>> cache = LRUCache(maxsize=10, sizeof=len)
+    >>> cache.set('a', 'x' * 6)
+    >>> cache.set('b', 'x' * 6)
+    >>> cache.get('a') is None
+    True
+
+    Values which grow after being set must be resized to be counted.
+
+    >>> cache = LRUCache(maxsize=10, sizeof=len)
+    >>> cache.set('a', ['x'] * 4)
+    >>> cache.set('b', ['x'] * 4)
+    >>> cache.get('b').extend(['x'] * 4)
+    >>> cache.resize('b')
+    >>> cache.get('a') is None
+    True
+    """
+    def __init__(self, maxsize: int = 1024, sizeof: Optional[Callable[[Any], int]] = None):
+        self._maxsize = maxsize
+        self._sizeof = sizeof or (lambda value: 1)
+        self._sizes = {}
+        self._size = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """ Get the value for key, marking it as recently used. """
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def set(self, key: Hashable, value: Any):
+        """ Store a value, evicting the least recently used entry if the cache is full. """
+        size = self._sizeof(value)
+        with self._lock:
+            self._size += size - self._sizes.get(key, 0)
+            self._sizes[key] = size
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while self._size > self._maxsize and len(self._data) > 1:
+                (evicted, _) = self._data.popitem(last=False)
+                self._size -= self._sizes.pop(evicted)
+
+    def resize(self, key: Hashable):
+        """ Measure the value for key again after it has changed, evicting the least recently used entries
+        if the cache is now full. Does nothing if key isn't cached. """
+        with self._lock:
+            if key not in self._data:
+                return
+            size = self._sizeof(self._data[key])
+            self._size += size - self._sizes[key]
+            self._sizes[key] = size
+            while self._size > self._maxsize and len(self._data) > 1:
+                (evicted, _) = self._data.popitem(last=False)
+                self._size -= self._sizes.pop(evicted)
+
+    def discard(self, predicate: Callable[[Hashable], bool]):
+        """ Remove every entry whose key matches the given predicate. """
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+                self._size -= self._sizes.pop(key)
+
+    def clear(self):
+        """ Remove every entry. """
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self._size = 0
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DiskCache:
+    """ A size bounded cache of files in a directory which evicts the least recently used files.
+    Keys must be safe to use as file names. Recency is tracked with each file's modification time
+    so that every worker process sharing the directory shares the cache.
+
+    The total size is kept in a file alongside the entries, so writes only scan the directory when the
+    cache is over its limit. Eviction then goes down to 90% of the limit so scans are spread out.
+    Entries larger than max_entry_bytes (an eighth of the cache by default) are not cached, since each
+    would evict much of the cache.
+
+    >>> cache = DiskCache(tempfile.mkdtemp(), max_bytes=8, max_entry_bytes=6)
+    >>> b''.join(cache.tee('aa', [b'abc', b'def']))
+    b'abcdef'
+    >>> with cache.open('aa') as f: f.read()
+    b'abcdef'
+    >>> cache.set('bb', b'ghi')
+    >>> cache.open('aa') is None
+    True
+    >>> cache.set('cc', b'too large')
+    >>> 'cc' in cache
+    False
+    """
+    _SIZE_FILE = '.size'
+
+    def __init__(self, directory: str, max_bytes: int, max_entry_bytes: Optional[int] = None):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._max_entry_bytes = max_bytes // 8 if max_entry_bytes is None else max_entry_bytes
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._directory, key[:2], key)
+
+    def open(self, key: str) -> Optional[BinaryIO]:
+        """ Open the cached file for key, marking it as recently used, or return None if it isn't cached. """
+        path = self._path(key)
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass  # Evicted after being opened, the open file can still be read.
+        return f
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def tee(self, key: str, chunks: Iterable[bytes], length: Optional[int] = None) -> Iterator[bytes]:
+        """ Pass chunks through while writing them to the cache. The file is only
+        added to the cache if every chunk is consumed and it isn't too large.
+        If length is given and too large, nothing is written. """
+        if length is not None and length > self._max_entry_bytes:
+            yield from chunks
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        f = os.fdopen(fd, 'wb')
+        written = 0
+        stored = False
+        try:
+            for chunk in chunks:
+                if f is not None:
+                    written += len(chunk)
+                    if written > self._max_entry_bytes:
+                        f.close()
+                        f = None
+                    else:
+                        f.write(chunk)
+                yield chunk
+            if f is not None:
+                f.close()
+                f = None
+                os.replace(temp, path)
+                stored = True
+        finally:
+            if f is not None:
+                f.close()
+            if os.path.exists(temp):
+                os.unlink(temp)
+        if stored and self._add_size(written) > self._max_bytes:
+            self.evict()
+
+    def set(self, key: str, content: bytes):
+        """ Store content in the cache. """
+        for _ in self.tee(key, [content], len(content)):
+            pass
+
+    def _update_size(self, update: Callable[[Optional[int]], int]) -> int:
+        """ Replaces the recorded total size with update(total), where total is None if it hasn't been
+        recorded. Returns the new total. The file is locked so that processes don't lose each other's updates. """
+        fd = os.open(os.path.join(self._directory, self._SIZE_FILE), os.O_RDWR | os.O_CREAT)
+        with os.fdopen(fd, 'r+') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            text = f.read().strip()
+            total = update(int(text) if text else None)
+            f.seek(0)
+            f.truncate()
+            f.write(str(total))
+            return total
+
+    def _add_size(self, size: int) -> int:
+        """ Adds size bytes to the recorded total, returning it. If there is no total yet,
+        for example in a directory written before totals were kept, it is over the limit so a scan records one. """
+        return self._update_size(lambda total: self._max_bytes + size if total is None else total + size)
+
+    def evict(self):
+        """ Remove the least recently used files until the cache fits in 90% of its size limit,
+        recording the resulting total size. """
+        entries = []
+        total = 0
+        for folder in os.scandir(self._directory):
+            if not folder.is_dir():
+                continue
+            for entry in os.scandir(folder.path):
+                if entry.name.endswith('.tmp'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        entries.sort()
+        target = self._max_bytes * 9 // 10
+        for (_, size, path) in entries:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        # Writes made during the scan are lost from the total, so it may be a little low until the next scan.
+        self._update_size(lambda _: total)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,86 @@
+"""
+Command line tools for managing the unique challenges plugin.
+
+Usage:
+    python cli.py provision-flags [--challenge ID] [--batch-size N]
+    python cli.py migrate-files
+    python cli.py warm-generated-files [--script ID]
+"""
+# Fix import paths, see create_test_data.py
+import sys
+from os.path import join, dirname, abspath
+sys.path.append(abspath(join(dirname(__file__), '..', '..', '..')))
+
+import argparse
+
+from CTFd import create_app
+
+
+def provision_flags_command(args):
+    """ Creates every missing unique flag """
+    from CTFd.plugins.unique_challenges.helpers import provision_flags
+
+    def progress(checked, total, created):
+        print(f"\rChecked {checked}/{total} challenge/account pairs, created {created} flags", end='', flush=True)
+
+    result = provision_flags(args.challenge or None, args.batch_size, progress)
+    print()
+    print(f"Done, created {result['created']} flags.")
+
+
+def migrate_files_command(args):
+    """ Moves unique file content out of the database """
+    from CTFd.plugins.unique_challenges.helpers import migrate_unique_files
+
+    def progress(moved, total):
+        print(f"\rMoved {moved}/{total} files", end='', flush=True)
+
+    moved = migrate_unique_files(progress)
+    print()
+    print(f"Done, moved {moved} files to disk.")
+
+
+def warm_generated_files_command(args):
+    """ Runs deterministic generated file scripts for every user """
+    from CTFd.plugins.unique_challenges.helpers import warm_generated_files
+
+    def progress(status):
+        print(f"\rGenerated {status['done']}/{status['total']} files, {status['cached']} already cached, "
+              f"{status['failed']} failed", end='', flush=True)
+
+    status = warm_generated_files(args.script or None, progress)
+    print()
+    for stats in status['scripts'].values():
+        mean = stats['seconds'] / stats['runs'] if stats['runs'] else 0
+        print(f"{stats['name']}: {stats['runs']} runs, {stats['failures']} failed, "
+              f"mean {mean:.3f}s, max {stats['max_seconds']:.3f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the unique challenges plugin")
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    provision = commands.add_parser('provision-flags', help="Create unique flags for every account ahead of time")
+    provision.add_argument('--challenge', type=int, action='append',
+                           help="Only create flags for this challenge, may be given multiple times")
+    provision.add_argument('--batch-size', type=int, default=1000, help="Number of flags inserted per statement")
+    provision.set_defaults(run=provision_flags_command)
+
+    migrate = commands.add_parser('migrate-files', help="Move unique file content from the database to disk")
+    migrate.set_defaults(run=migrate_files_command)
+
+    warm = commands.add_parser('warm-generated-files',
+                               help="Cache the output of deterministic scripts for every user ahead of time")
+    warm.add_argument('--script', type=int, action='append',
+                      help="Only run this script, may be given multiple times")
+    warm.set_defaults(run=warm_generated_files_command)
+
+    args = parser.parse_args()
+    app = create_app()
+    with app.app_context():
+        args.run(args)
+
+
+if __name__ == '__main__':
+    main()
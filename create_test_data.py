@@ -9,6 +9,7 @@ from os.path import join, dirname, abspath
 sys.path.append(abspath(join(dirname(__file__), '..', '..', '..')))
 
 import random
+import hashlib
 from secrets import token_hex
 from collections import defaultdict
 
@@ -24,6 +25,7 @@ from CTFd.plugins.unique_challenges.models import (
     UniqueChallengeCohort,
     UniqueChallengeCohortMembership,
 )
+from CTFd.plugins.unique_challenges.helpers import store_unique_file
 
 app = create_app()
 
@@ -156,13 +158,17 @@ with app.app_context():
     for (c_name, name, content) in files:
         challenge = UniqueChallenges.query.filter_by(name=c_name).one()
         if not UniqueChallengeFiles.query.filter_by(challenge_id=challenge.id, name=name).first():
-            row = UniqueChallengeFiles(challenge_id=challenge.id, name=name, content=bytes(content, 'utf-8'))
+            row = UniqueChallengeFiles(challenge_id=challenge.id, name=name)
             db.session.add(row)
+            db.session.flush()
+            store_unique_file(row, bytes(content, 'utf-8'))
 
     for (c_name, name, script) in scripts:
         challenge = UniqueChallenges.query.filter_by(name=c_name).one()
         if not UniqueChallengeScript.query.filter_by(challenge_id=challenge.id, name=name).first():
-            row = UniqueChallengeScript(challenge_id=challenge.id, name=name, script=bytes(script, 'utf-8'))
+            content = bytes(script, 'utf-8')
+            row = UniqueChallengeScript(challenge_id=challenge.id, name=name, script=content,
+                                        sha256=hashlib.sha256(content).hexdigest())
             db.session.add(row)
 
     for (name, script) in requirements:
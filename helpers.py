@@ -2,24 +2,209 @@
 Contains helper functions for working with the challenge flags.
 """
 
+import os
 import sys
+import threading
 import time
-from io import TextIOWrapper, BytesIO
+import datetime
+import hashlib
+import hmac
+import json
+import base64
 import re
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from secrets import token_hex
-from flask import abort
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Set, Tuple, Optional
+from flask import abort, g, current_app
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
 
+from CTFd.cache import cache
 from CTFd.utils.user import get_current_user, get_current_team, is_admin
-from CTFd.utils import config
-from CTFd.models import db, Solves, Challenges
+from CTFd.utils import config, get_config, set_config
+from CTFd.models import db, Solves, Challenges, Submissions, Users, Teams, Configs
 
-from .lispish import LispIsh, LispIshParseError, LispIshRuntimeError
-from .models import UniqueFlags, UniqueChallengeRequirements, UniqueChallengeCohort, UniqueChallengeCohortMembership
+from .caching import LRUCache
+from .audit import AuditRow, AccountFlagIndex, FLAG_CANDIDATE_REGEX, audit_challenge
+from .scripts import ScriptPool, ScriptQueueFull, ScriptResult, compile_script, dump_script
+from .storage import store_content, open_content, content_size, rendered_cache, generated_cache, storage_setting
+from .placeholders import (
+    Template,
+    compile_template,
+    render_template,
+    placeholder_values,
+    iter_chunks,
+    find_placeholders,
+    splice_placeholders,
+    spliced_length,
+    CHUNK_SIZE,
+)
+from .lispish import (
+    LispIsh,
+    LispIshValue,
+    LispIshMethod,
+    LispIshNumber,
+    LispIshString,
+    LispIshMethods,
+    LispIshParseError,
+    LispIshRuntimeError,
+)
+from .models import (
+    UniqueFlags,
+    UniqueChallenges,
+    UniqueChallengeFiles,
+    UniqueChallengeFilePlaceholder,
+    UniqueChallengeScript,
+    UniqueChallengeRequirements,
+    UniqueChallengeRequirementDependency,
+    UniqueChallengeCohort,
+    UniqueChallengeCohortMembership,
+    UniqueAuditFinding,
+)
 
+# Compiled requirement scripts, keyed by (challenge id, sha256 of the script).
+# Including the hash means other worker processes never serve a stale script.
+_requirements_cache = LRUCache(maxsize=1024)
+
+# Compiled description templates, keyed by (challenge id, sha256 of the description).
+_description_cache = LRUCache(maxsize=1024)
+
+# Compiled generated file scripts, keyed by (script id, sha256 of the script).
+_script_cache = LRUCache(maxsize=256)
+
+# Flag indexes used to check submissions as they are made, keyed by (challenge id, teams mode, flag mode).
+# Created by get_live_flag_indexes since its size is configured in the app config.
+_live_flag_indexes = None
+# Keys of the live flag indexes being built in the background.
+_live_flag_index_builds: Set[tuple] = set()
+_live_flag_index_lock = threading.Lock()
+
+# Worker processes which run generated file scripts, see get_script_pool.
+_script_pool = None
+_script_pool_lock = threading.Lock()
+
+# How long requirement results are cached for when nothing invalidates them sooner.
+REQUIREMENT_RESULT_TIMEOUT = 60 * 60
+
+# Functions provided to requirement scripts by RequirementContext.functions, along with
+# a relative cost so that (and)/(or) try cheap checks before ones which may need a query.
+REQUIREMENT_FUNCTIONS = {
+    'USER-EMAIL': 1,
+    'USER-NAME': 1,
+    'USER-ID': 1,
+    'BEFORE': 2,
+    'AFTER': 2,
+    'COMPLETED': 10,
+    'COHORT': 10,
+    'USER-SCORE': 10,
+}
+
+
+DerivedFlags = namedtuple('DerivedFlags', ['challenge_id', 'user_id', 'team_id', 'flag_8', 'flag_16', 'flag_32'])
+DerivedFlags.__doc__ = """ Flags computed from the plugin's secret instead of being stored in unique_flags.
+Has the same attributes as UniqueFlags. """
+
+def flag_mode() -> str:
+    """ Gets how flags are created for accounts without stored flags.
+    stored - random flags are stored in unique_flags the first time they are needed
+    derived - flags are an HMAC of the challenge and account, nothing is stored
+    """
+    return get_config("unique_challenges_flag_mode", "stored")
+
+# Set once derived flags have been used, see new_flags_row.
+FLAGS_DERIVED_KEY = "unique_challenges_flags_derived"
+
+def set_flag_mode(mode: str):
+    """ Changes how flags are created, see flag_mode """
+    # Checking the current mode as well covers switching away from derived flags enabled before this was tracked.
+    if mode == "derived" or flag_mode() == "derived":
+        set_config(FLAGS_DERIVED_KEY, True)
+    set_config("unique_challenges_flag_mode", mode)
+
+FLAG_SECRET_KEY = "unique_challenges_flag_secret"
+FLAG_SECRET_LOCK_KEY = "unique_challenges_flag_secret_lock"
+
+def _stored_flag_secret() -> Optional[str]:
+    """ Reads the flag secret from the database, bypassing get_config's cache """
+    row = Configs.query.filter_by(key=FLAG_SECRET_KEY).order_by(Configs.id).first()
+    # End the transaction so that polling sees rows committed by other workers.
+    db.session.commit()
+    return row.value if row and row.value else None
+
+def ensure_flag_secret(wait_seconds: float = 60):
+    """ Creates the key used to derive flags if there isn't one yet. Called when the plugin loads,
+    before any requests are served, so the secret never changes once flags have been derived from it.
+    set_config overwrites rather than keeping the first value, so workers loading at the same time
+    take a lock in the CTFd cache, and the rest wait for the secret to appear.
+    """
+    if _stored_flag_secret():
+        return
+    if cache.add(FLAG_SECRET_LOCK_KEY, True, timeout=wait_seconds):
+        try:
+            if not _stored_flag_secret():
+                set_config(FLAG_SECRET_KEY, token_hex(32))
+        finally:
+            cache.delete(FLAG_SECRET_LOCK_KEY)
+        return
+    deadline = time.time() + wait_seconds
+    while not _stored_flag_secret():
+        if time.time() > deadline:
+            raise RuntimeError("Timed out waiting for another worker to create the unique flag secret")
+        time.sleep(0.1)
+
+def _flag_secret() -> bytes:
+    """ Gets the key used to derive flags, created by ensure_flag_secret when the plugin loads.
+    Separate from SECRET_KEY so that rotating that doesn't change every derived flag. """
+    secret = get_config(FLAG_SECRET_KEY)
+    if not secret:
+        # Only if the config was cleared after loading, for example by resetting the CTF.
+        ensure_flag_secret()
+        secret = _stored_flag_secret()
+    return bytes(secret, 'utf-8')
+
+def derive_flags(challenge_id: int, user_id: Optional[int] = None, team_id: Optional[int] = None,
+                 secret: Optional[bytes] = None) -> DerivedFlags:
+    """ Computes the derived flags for an account, pass team_id in teams mode and user_id otherwise. """
+    if secret is None:
+        secret = _flag_secret()
+    account = f"team:{team_id}" if team_id is not None else f"user:{user_id}"
+
+    def derive(length: int) -> str:
+        message = bytes(f"{int(challenge_id)}:{account}:flag_{length}", 'utf-8')
+        return hmac.new(secret, message, hashlib.sha256).hexdigest()[:length]
+
+    return DerivedFlags(challenge_id, user_id, team_id, derive(8), derive(16), derive(32))
+
+def new_flags_row(challenge_id: int, teams_mode: bool, account_id: int, secret: Optional[bytes]) -> dict:
+    """ Creates a unique_flags row for an account, random unless secret is given, in which case the
+    account's derived flags are stored. See new_flags_secret. """
+    if secret is not None:
+        derived = derive_flags(challenge_id, user_id=account_id, secret=secret) if not teams_mode \
+            else derive_flags(challenge_id, team_id=account_id, secret=secret)
+        flag_8, flag_16, flag_32 = derived.flag_8, derived.flag_16, derived.flag_32
+    else:
+        flag_8, flag_16, flag_32 = token_hex(4), token_hex(8), token_hex(16)
+    return dict(
+        challenge_id=challenge_id,
+        user_id=None if teams_mode else account_id,
+        team_id=account_id if teams_mode else None,
+        flag_8=flag_8,
+        flag_16=flag_16,
+        flag_32=flag_32
+    )
+
+def new_flags_secret() -> Optional[bytes]:
+    """ Gets the secret to create stored flags from, if derived flags have ever been used.
+    Accounts without stored flags may already have been shown their derived flags, so switching
+    back to stored flags stores those rather than new random flags. """
+    return _flag_secret() if get_config(FLAGS_DERIVED_KEY) else None
 
 def get_flags_for_challenge(challenge_id):
-    """ Assumes the user already has unique flags created by
-    ensure_flags_for_challenge."""
+    """ Gets the stored flags for the current user or team. Assumes the user already has
+    unique flags created by ensure_flags_for_challenge, and will return None for accounts
+    using derived flags."""
     if config.is_teams_mode():
         return UniqueFlags.query.filter_by(
             challenge_id=challenge_id,
@@ -32,41 +217,154 @@ def get_flags_for_challenge(challenge_id):
         ).first()
 
 
+# SQLite before 3.32 allows at most this many bind parameters in a statement.
+SQLITE_MAX_VARIABLES = 999
+
+def rows_per_insert(columns: int, batch_size: int = 1000) -> int:
+    """ Limits the rows in a multi-row INSERT of the given number of columns so that its
+    bind parameters fit within the database's limit. """
+    if db.engine.dialect.name == 'sqlite':
+        return max(1, min(batch_size, SQLITE_MAX_VARIABLES // columns))
+    return batch_size
+
+def insert_ignoring_duplicates(table, rows: List[dict]):
+    """ Builds a multi-row INSERT which silently skips rows that would violate a unique
+    constraint, so concurrent requests can race to create the same row. """
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert(table).values(rows).on_conflict_do_nothing()
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+        return insert(table).values(rows).on_duplicate_key_update(id=table.c.id)
+    if dialect == 'sqlite':
+        return table.insert().values(rows).prefix_with('OR IGNORE')
+    return table.insert().values(rows)
+
 def ensure_flags_for_challenge(challenge_id, also_admins=False):
     """ Makes sure that there is a flag for the given challenge
-    and current user. Will not create flags if the user is an admin unless also_admins is true. """
+    and current user. Will not create flags if the user is an admin unless also_admins is true.
+    Returns the flags, or None if the user is an admin and also_admins is false.
+    In derived mode, accounts which already have stored flags keep them, and nothing is written
+    for any other account. """
     # Admins don't get flags, their input is passed through without
     # replacement.
     if is_admin() and not also_admins:
-        return
+        return None
     user = get_current_user()
     if not user:
         abort(401) # Unauthorized
     if config.is_teams_mode() and not get_current_team():
         abort(401) # Cannot complete challenge, so don't create flags
 
-    if config.is_teams_mode():
-        flags = UniqueFlags.query.filter_by(
-            challenge_id=challenge_id,
-            team_id=get_current_team().id
-        ).first()
-    else:
-        flags = UniqueFlags.query.filter_by(
-            challenge_id=challenge_id,
-            user_id=user.id
-        ).first()
-
+    flags = get_flags_for_challenge(challenge_id)
+    if not flags and flag_mode() == "derived":
+        if config.is_teams_mode():
+            return derive_flags(challenge_id, team_id=get_current_team().id)
+        return derive_flags(challenge_id, user_id=user.id)
     if not flags: # Missing, insert new flags
-        flags = UniqueFlags(
-            challenge_id=challenge_id,
-            user_id=user.id if not config.is_teams_mode() else None,
-            team_id=get_current_team().id if config.is_teams_mode() else None,
-            flag_8=token_hex(4),
-            flag_16=token_hex(8),
-            flag_32=token_hex(16)
+        # Another request may be inserting flags at the same time, the unique
+        # constraints on unique_flags guarantee only one set is kept.
+        teams_mode = config.is_teams_mode()
+        account_id = get_current_team().id if teams_mode else user.id
+        row = new_flags_row(challenge_id, teams_mode, account_id, new_flags_secret())
+        if db.engine.dialect.name == 'postgresql':
+            # Returns whichever set of flags was kept, so no second query is needed.
+            flags = db.session.execute(_upsert_flags_returning(row, teams_mode)).first()
+            db.session.commit()
+        else:
+            db.session.execute(insert_ignoring_duplicates(UniqueFlags.__table__, [row]))
+            db.session.commit()
+            flags = get_flags_for_challenge(challenge_id)
+    return flags
+
+def _upsert_flags_returning(row: dict, teams_mode: bool):
+    """ Builds an INSERT for PostgreSQL which returns the new flags, or the existing flags if another
+    request inserted them first. The no-op update makes conflicting rows visible to RETURNING. """
+    from sqlalchemy.dialects.postgresql import insert
+    table = UniqueFlags.__table__
+    return (
+        insert(table).values(row)
+        .on_conflict_do_update(
+            # Older databases have unique indexes rather than constraints, which index_elements also matches.
+            index_elements=[table.c.challenge_id, table.c.team_id if teams_mode else table.c.user_id],
+            set_=dict(flag_8=table.c.flag_8)
         )
-        db.session.add(flags)
-        db.session.commit()
+        .returning(table.c.challenge_id, table.c.user_id, table.c.team_id,
+                   table.c.flag_8, table.c.flag_16, table.c.flag_32)
+    )
+
+def provision_flags(challenge_ids: Optional[Iterable[int]] = None, batch_size: int = 1000,
+                    progress: Optional[Callable[[int, int, int], None]] = None) -> Dict[str, int]:
+    """ Creates unique flags for every account on every unique challenge (or only the given challenges)
+    which doesn't have them yet, so they don't need to be created one at a time as accounts
+    open challenges. Flags are inserted batch_size rows per statement, or fewer if the database
+    limits the number of bind parameters.
+    If given, progress is called with (pairs checked, total pairs, flags created) after each batch.
+    Returns the number of pairs checked and the number of flags created.
+    Does nothing when using derived flags.
+    """
+    if flag_mode() == "derived":
+        return dict(checked=0, created=0)
+    teams_mode = config.is_teams_mode()
+    if teams_mode:
+        accounts = [team_id for (team_id,) in Teams.query.with_entities(Teams.id)]
+        account_column = UniqueFlags.team_id
+    else:
+        # Admins don't get flags for challenges, see ensure_flags_for_challenge.
+        accounts = [user_id for (user_id,) in Users.query.with_entities(Users.id).filter(Users.type != 'admin')]
+        account_column = UniqueFlags.user_id
+
+    query = UniqueChallenges.query.with_entities(UniqueChallenges.id)
+    if challenge_ids is not None:
+        query = query.filter(UniqueChallenges.id.in_([int(challenge_id) for challenge_id in challenge_ids]))
+    challenges = [challenge_id for (challenge_id,) in query]
+
+    secret = new_flags_secret()
+    batch_size = rows_per_insert(len(UniqueFlags.__table__.columns) - 1, batch_size)
+    total = len(challenges) * len(accounts)
+    checked = created = 0
+    pending = []
+
+    def flush():
+        nonlocal created
+        if pending:
+            created += db.session.execute(insert_ignoring_duplicates(UniqueFlags.__table__, pending)).rowcount
+            db.session.commit()
+            pending.clear()
+
+    for challenge_id in challenges:
+        existing = {
+            account_id for (account_id,) in
+            db.session.query(account_column).filter(UniqueFlags.challenge_id == challenge_id)
+        }
+        for account_id in accounts:
+            checked += 1
+            if account_id in existing:
+                continue
+            pending.append(new_flags_row(challenge_id, teams_mode, account_id, secret))
+            if len(pending) >= batch_size:
+                flush()
+                if progress:
+                    progress(checked, total, created)
+    flush()
+    if progress:
+        progress(checked, total, created)
+    return dict(checked=checked, created=created)
+
+def get_description_template(challenge_id: int, description: str) -> Template:
+    """ Gets the compiled template for a challenge description, compiling it only once per revision. """
+    key = (int(challenge_id), hashlib.sha256(bytes(description, 'utf-8')).hexdigest())
+    template = _description_cache.get(key)
+    if template is None:
+        template = compile_template(description)
+        _description_cache.set(key, template)
+    return template
+
+def invalidate_description(challenge_id: int):
+    """ Drops any compiled templates for the given challenge's description. """
+    challenge_id = int(challenge_id)
+    _description_cache.discard(lambda key: key[0] == challenge_id)
 
 def get_unique_challenge_description(challenge):
     """ Replaces the challenge description with the unique flags for the given
@@ -75,32 +373,183 @@ def get_unique_challenge_description(challenge):
     """
     if is_admin():
         return challenge.description
-    ensure_flags_for_challenge(challenge.id)
-    username = get_current_user().name
-    unique_flags = get_flags_for_challenge(challenge.id)
-    regex = re.compile(r"!name!|!flag_8!|!flag_16!|!flag_32!")
-    return regex.sub(
-        lambda match: username if match.group(0) == "!name!"
-        else getattr(unique_flags, match.group(0)[1:-1]),
-        challenge.description
-    )
+    if not challenge.description:
+        return challenge.description
+    unique_flags = ensure_flags_for_challenge(challenge.id)
+    template = get_description_template(challenge.id, challenge.description)
+    return render_template(template, placeholder_values(unique_flags, get_current_user().name))
 
-def get_unique_challenge_file(challenge, content):
-    """ Replaces placeholders in the given content for the current user
-    or returns the raw content if the user is an admin.
+def get_unique_file_values(challenge) -> Optional[Dict[str, bytes]]:
+    """ Gets the bytes each placeholder should be replaced with in files downloaded by the
+    current user, or None if the user is an admin and should get the raw content.
     """
     if is_admin():
-        return content
-    ensure_flags_for_challenge(challenge.id)
-    username = get_current_user().name
-    unique_flags = get_flags_for_challenge(challenge.id)
-    regex = re.compile(rb"!name!|!flag_8!|!flag_16!|!flag_32!")
-    return regex.sub(
-        lambda match: bytes(username, 'ascii') if match.group(0) == b"!name!"
-        else bytes(getattr(unique_flags, match.group(0)[1:-1].decode('utf-8')), 'ascii'),
-        content
+        return None
+    unique_flags = ensure_flags_for_challenge(challenge.id)
+    return {
+        name: bytes(value, 'utf-8')
+        for name, value in placeholder_values(unique_flags, get_current_user().name).items()
+    }
+
+def index_unique_file(file, content):
+    """ Records the offset of every placeholder in a unique file. Does not commit the session. """
+    UniqueChallengeFilePlaceholder.query.filter_by(file_id=file.id).delete()
+    rows = [
+        dict(file_id=file.id, offset=offset, placeholder=name)
+        for (offset, name) in find_placeholders(iter_chunks(content))
+    ]
+    table = UniqueChallengeFilePlaceholder.__table__
+    batch_size = rows_per_insert(len(rows[0]) if rows else 1)
+    for start in range(0, len(rows), batch_size):
+        db.session.execute(insert_ignoring_duplicates(table, rows[start:start + batch_size]))
+    file.placeholder_count = len(rows)
+
+def store_unique_file(file, content: bytes):
+    """ Writes the content of a unique file to disk and indexes its placeholders.
+    The file must have been flushed so that it has an id. Does not commit the session. """
+    file.location = store_content(content)
+    file.content = None
+    file.sha256 = file.location
+    file.size = len(content)
+    index_unique_file(file, content)
+
+@contextmanager
+def open_unique_file(file):
+    """ Gets the content of a unique file as a bytes-like object. Content stored on disk is
+    memory mapped, so it must not be used after the context exits. """
+    if file.location is None:
+        yield file.content
+    else:
+        with open_content(file.location) as content:
+            yield content
+
+def unique_file_size(file) -> int:
+    """ Gets the size of a unique file's content without reading it """
+    if file.size is not None:
+        return file.size
+    if file.location is None:
+        return len(file.content)
+    return content_size(file.location)
+
+def _stream_unique_file(file, stream) -> Iterator[bytes]:
+    """ Streams the chunks produced by calling stream with the file's content,
+    keeping the content open until the last chunk has been sent. """
+    with open_unique_file(file) as content:
+        yield from stream(content)
+
+def get_placeholder_offsets(file) -> List[Tuple[int, str]]:
+    """ Gets the (offset, name) of every placeholder in a unique file, in order.
+    Files uploaded before placeholders were indexed are indexed by the migrations, this only
+    indexes files which the migrations missed. """
+    if file.placeholder_count is None:
+        with open_unique_file(file) as content:
+            index_unique_file(file, content)
+        db.session.commit()
+    return (
+        UniqueChallengeFilePlaceholder.query
+        .with_entities(UniqueChallengeFilePlaceholder.offset, UniqueChallengeFilePlaceholder.placeholder)
+        .filter_by(file_id=file.id)
+        .order_by(UniqueChallengeFilePlaceholder.offset)
+        .all()
     )
 
+def delete_unique_files(query) -> Set[str]:
+    """ Deletes the unique files matched by the given query along with their placeholders.
+    Does not commit the session. Returns the locations of stored content which is no longer
+    used by any file, which should be removed with storage.remove_content after committing. """
+    deleted = query.with_entities(UniqueChallengeFiles.id, UniqueChallengeFiles.location).all()
+    file_ids = [file_id for (file_id, _) in deleted]
+    if file_ids:
+        UniqueChallengeFilePlaceholder.query.filter(
+            UniqueChallengeFilePlaceholder.file_id.in_(file_ids)
+        ).delete(synchronize_session=False)
+    query.delete(synchronize_session=False)
+
+    locations = {location for (_, location) in deleted if location}
+    if not locations:
+        return set()
+    in_use = (
+        UniqueChallengeFiles.query
+        .with_entities(UniqueChallengeFiles.location)
+        .filter(UniqueChallengeFiles.location.in_(locations))
+        .distinct()
+    )
+    return locations - {location for (location,) in in_use}
+
+def migrate_unique_files(progress: Callable[[int, int], None] = None) -> int:
+    """ Moves the content of unique files which are still stored in the database onto disk.
+    Files are moved and committed one at a time so that only one is held in memory.
+    Returns the number of files moved.
+    """
+    file_ids = [
+        file_id for (file_id,) in
+        UniqueChallengeFiles.query
+        .with_entities(UniqueChallengeFiles.id)
+        .filter(UniqueChallengeFiles.location.is_(None))
+        .order_by(UniqueChallengeFiles.id)
+    ]
+    for (i, file_id) in enumerate(file_ids):
+        file = UniqueChallengeFiles.query.filter_by(id=file_id).one()
+        store_unique_file(file, file.content or b'')
+        db.session.commit()
+        db.session.expunge(file)
+        if progress:
+            progress(i + 1, len(file_ids))
+    return len(file_ids)
+
+FileDownload = namedtuple('FileDownload', ['chunks', 'length', 'etag'])
+FileDownload.__doc__ = """ A file to send to the current user. chunks is None if the etags the client
+sent show that it already has this version of the file. """
+
+def _digest(*parts) -> str:
+    """ Hashes the given strings and bytes into a single hex digest """
+    digest = hashlib.sha256()
+    for part in parts:
+        part = part if isinstance(part, bytes) else bytes(str(part), 'utf-8')
+        digest.update(len(part).to_bytes(8, 'big'))
+        digest.update(part)
+    return digest.hexdigest()
+
+def _read_chunks(f) -> Iterator[bytes]:
+    """ Reads an open file in chunks, closing it once it has been read """
+    with f:
+        chunk = f.read(CHUNK_SIZE)
+        while chunk:
+            yield chunk
+            chunk = f.read(CHUNK_SIZE)
+
+# Part of the etag of rendered files, changed to discard renders cached by clients and on disk.
+# 2 - files indexed twice at once could have duplicate placeholders which were spliced in twice.
+RENDER_VERSION = 2
+
+def get_unique_challenge_file(challenge, file, etags=None) -> FileDownload:
+    """ Replaces placeholders in the given file for the current user
+    or returns the raw content if the user is an admin. The content is returned in chunks
+    along with its total length so that it can be streamed. Flags are looked up before this returns.
+    The etag is derived from the content and the values substituted into it, so rendered files are
+    cached on disk under it. etags should be the request's If-None-Match header.
+    """
+    values = get_unique_file_values(challenge)
+    if values is None:
+        etag = file.sha256
+        if etags is not None and etags.contains_weak(etag):
+            return FileDownload(None, None, etag)
+        return FileDownload(_stream_unique_file(file, iter_chunks), unique_file_size(file), etag)
+
+    etag = _digest(RENDER_VERSION, file.sha256, *(part for item in sorted(values.items()) for part in item))
+    if etags is not None and etags.contains_weak(etag):
+        return FileDownload(None, None, etag)
+
+    cache = rendered_cache()
+    cached = cache.open(etag)
+    if cached is not None:
+        return FileDownload(_read_chunks(cached), os.fstat(cached.fileno()).st_size, etag)
+
+    offsets = get_placeholder_offsets(file)
+    chunks = _stream_unique_file(file, lambda content: splice_placeholders(content, offsets, values))
+    length = spliced_length(unique_file_size(file), offsets, values)
+    return FileDownload(cache.tee(etag, chunks, length), length, etag)
+
 def replace_submission(challenge, submission):
     """ Normalizes the submission so that static flags can include
     the placeholders to allow participants to complete the challenge.
@@ -117,8 +566,7 @@ def replace_submission(challenge, submission):
     if any([p in submission for p in placeholders]):
         return True, None
 
-    ensure_flags_for_challenge(challenge.id)
-    unique_flags = get_flags_for_challenge(challenge.id)
+    unique_flags = ensure_flags_for_challenge(challenge.id)
     replacements = {
         get_current_user().name: "!name!",
         unique_flags.flag_8: "!flag_8!",
@@ -128,44 +576,293 @@ def replace_submission(challenge, submission):
     regex = re.compile("|".join(map(re.escape, replacements)))
     return False, regex.sub(lambda match: replacements[match.group(0)], submission)
 
-class CaptureExec:
-    """ Helper class to wrap user scripts that print to stdout.
+def get_script_code(file):
+    """ Gets the compiled code for a generated file script, ready to be sent to a ScriptPool, re-using
+    a previous compile if possible. The script itself is only loaded from the database if it has not
+    been compiled already. """
+    key = (file.id, file.sha256)
+    code = _script_cache.get(key) if file.sha256 else None
+    if code is None:
+        code = dump_script(compile_script(file.id, file.script.decode('utf-8')))
+        if file.sha256:
+            _script_cache.set(key, code)
+    return code
+
+def get_script_pool() -> ScriptPool:
+    """ Gets the pool of worker processes used to run generated file scripts.
+    Its size and limits are configured with UNIQUE_CHALLENGES_SCRIPT_* app config or environment settings. """
+    global _script_pool
+    with _script_pool_lock:
+        if _script_pool is None:
+            workers = int(storage_setting('UNIQUE_CHALLENGES_SCRIPT_WORKERS', os.cpu_count() or 1))
+            _script_pool = ScriptPool(
+                workers=workers,
+                queue_size=int(storage_setting('UNIQUE_CHALLENGES_SCRIPT_QUEUE', workers * 8)),
+                cpu_seconds=int(storage_setting('UNIQUE_CHALLENGES_SCRIPT_CPU_SECONDS', 10)),
+                wall_seconds=float(storage_setting('UNIQUE_CHALLENGES_SCRIPT_WALL_SECONDS', 30)),
+                memory_bytes=int(storage_setting('UNIQUE_CHALLENGES_SCRIPT_MEMORY_BYTES', 512 * 1024 * 1024))
+            )
+        return _script_pool
+
+def invalidate_script(script_id: int):
+    """ Drops any compiled code for the given generated file script. """
+    script_id = int(script_id)
+    _script_cache.discard(lambda key: key[0] == script_id)
+
+def get_generated_challenge_file(challenge, file, etags=None) -> FileDownload:
+    """ Calls an administrator provided script to generate content for the given user.
+    The etag is derived from the script and its placeholders. Unless the script is marked as
+    deterministic, it is weak since the script may not produce identical output each time it is run.
+    Output of deterministic scripts is cached on disk under the etag.
+    etags should be the request's If-None-Match header.
     """
-    def __init__(self, script: str):
-        self._script = script
+    # Even admins get flags for challenge files... There's a separate route for editing.
+    flags = ensure_flags_for_challenge(challenge.id, True)
+    placeholders = placeholder_values(flags, get_current_user().name)
+    etag = _generated_file_key(file, placeholders)
+    if etags is not None and etags.contains_weak(etag):
+        return FileDownload(None, None, etag)
+
+    cache = generated_cache() if file.deterministic and file.sha256 else None
+    if cache is not None:
+        cached = cache.open(etag)
+        if cached is not None:
+            return FileDownload(_read_chunks(cached), os.fstat(cached.fileno()).st_size, etag)
+
+    try:
+        result = _run_generated_script(get_script_code(file), file.name, placeholders)
+    except ScriptQueueFull:
+        abort(503)
+    content = bytes(result.output, 'utf-8')
+    # Failures may be due to load, so they are not cached.
+    if cache is not None and result.error is None:
+        cache.set(etag, content)
+    return FileDownload([content], len(content), etag)
+
+def _generated_file_key(file, placeholders: Dict[str, str]) -> str:
+    """ Gets the etag and cache key of a generated file for the given placeholders """
+    return _digest(file.sha256, *(part for item in sorted(placeholders.items()) for part in item))
+
+def _run_generated_script(code, name: str, placeholders: Dict[str, str]) -> ScriptResult:
+    """ Runs a script from get_script_code in the script pool, logging any error """
+    result = get_script_pool().run(code, dict(PLACEHOLDERS=placeholders))
+    if result.error is not None:
+        print(f"Exception when running admin code to generate {name}:", file=sys.stderr)
+        print(result.error, file=sys.stderr)
+    return result
 
-    def run(self, local_vars={}) -> str:
-        # Setup, capture stdout
-        old, sys.stdout = sys.stdout, TextIOWrapper(
-            BytesIO(), sys.stdout.encoding)
-        # Run user script, note that builtins are enabled. Untrusted input
-        # should not be passed to this function.
+# Progress of the current or last generated file warm up, see warm_generated_files.
+WARMUP_STATUS_KEY = "unique_challenges_generated_warmup"
+# A warm up which hasn't reported progress in this long is assumed to have died with its process.
+WARMUP_STALE_SECONDS = 5 * 60
+
+def _background_status(key: str) -> Optional[dict]:
+    """ Gets the status of a background job stored in the CTFd cache, marking it as stopped if its
+    thread hasn't updated it for WARMUP_STALE_SECONDS, for example because the worker was restarted. """
+    status = cache.get(key)
+    if status and status['running'] and time.time() - status['updated'] > WARMUP_STALE_SECONDS:
+        status['running'] = False
+        status['error'] = "Stopped responding"
+    return status
+
+def generated_file_warmup_status() -> Optional[dict]:
+    """ Gets the progress of the current or last generated file warm up, if there has been one """
+    return _background_status(WARMUP_STATUS_KEY)
+
+def _account_flags(challenge_id: int, teams_mode: bool) -> Callable[[object], object]:
+    """ Loads every account's flags for a challenge, returning a function to get a user's flags """
+    account_column = UniqueFlags.team_id if teams_mode else UniqueFlags.user_id
+    stored = {
+        getattr(flags, account_column.key): flags
+        for flags in UniqueFlags.query.filter(UniqueFlags.challenge_id == challenge_id, account_column.isnot(None))
+    }
+    secret = _flag_secret() if flag_mode() == "derived" else None
+
+    def get(user):
+        account_id = user.team_id if teams_mode else user.id
+        flags = stored.get(account_id)
+        if flags is None and secret is not None:
+            if teams_mode:
+                return derive_flags(challenge_id, team_id=account_id, secret=secret)
+            return derive_flags(challenge_id, user_id=account_id, secret=secret)
+        return flags
+    return get
+
+def warm_generated_files(script_ids: Optional[Iterable[int]] = None,
+                         progress: Optional[Callable[[dict], None]] = None) -> dict:
+    """ Runs every deterministic generated file script (or only the given scripts) for every user,
+    storing the output in the generated file cache so that downloads don't need to run them.
+    Missing flags are created first. Scripts which aren't deterministic can't be cached, so are skipped.
+
+    Scripts are run by as many threads as the script pool has workers, so this uses every worker.
+    The status, including timing for each script, is stored in the CTFd cache for
+    generated_file_warmup_status and passed to progress as it changes. Returns the final status.
+    The executor's threads have no app context, so only the calling thread reports progress.
+    """
+    query = UniqueChallengeScript.query.filter(
+        UniqueChallengeScript.deterministic == True,  # noqa: E712
+        UniqueChallengeScript.sha256.isnot(None)
+    )
+    if script_ids is not None:
+        query = query.filter(UniqueChallengeScript.id.in_([int(script_id) for script_id in script_ids]))
+    scripts = query.all()
+    provision_flags({script.challenge_id for script in scripts})
+
+    teams_mode = config.is_teams_mode()
+    users = Users.query.filter(Users.type != 'admin')
+    if teams_mode:
+        users = users.filter(Users.team_id.isnot(None))
+    users = users.all()
+
+    now = time.time()
+    status = dict(
+        running=True, started=now, updated=now, finished=None, error=None,
+        total=len(scripts) * len(users), done=0, cached=0, failed=0,
+        scripts={
+            str(script.id): dict(name=script.name, challenge_id=script.challenge_id,
+                                 runs=0, failures=0, seconds=0.0, max_seconds=0.0)
+            for script in scripts
+        }
+    )
+    lock = threading.Lock()
+    reported = 0.0
+
+    def report(force=False):
+        nonlocal reported
+        status['updated'] = time.time()
+        # Avoid writing to the cache for every script run
+        if force or status['updated'] - reported > 1:
+            reported = status['updated']
+            cache.set(WARMUP_STATUS_KEY, status, timeout=0)
+            if progress:
+                progress(status)
+
+    report(force=True)
+    generated = generated_cache()
+    pool = get_script_pool()
+    # Limits how many runs are waiting in the executor, rather than queueing every run up front.
+    max_pending = pool.workers * 4
+    pending = set()
+
+    def run(script_id, code, name, key, placeholders):
+        # Exceptions would be lost in the executor's future, so they are counted as failures here.
+        start = time.time()
         try:
-            exec(self._script, {}, local_vars)
+            while True:
+                try:
+                    result = _run_generated_script(code, name, placeholders)
+                    break
+                except ScriptQueueFull:
+                    # Downloads are using the rest of the queue, wait for them rather than failing.
+                    time.sleep(0.1)
+            if result.error is None:
+                generated.set(key, bytes(result.output, 'utf-8'))
         except Exception as e:
-            print("ERROR CREATING FILE: CONTACT AN ADMINISTRATOR")
-            print("Exception when running admin code to generate a file:", file=sys.stderr)
-            print(e, file=sys.stderr)
-        # Get the output
-        sys.stdout.seek(0)
-        out = sys.stdout.read()
-        sys.stdout.close()
-        sys.stdout = old
-        return out
-
-def get_generated_challenge_file(challenge, script: str) -> bytes:
-    """ Calls an administrator provided script to generate content for the given user"""
-    # Even admins get flags for challenge files... There's a separate route for editing.
-    ensure_flags_for_challenge(challenge.id, True)
-    flags = get_flags_for_challenge(challenge.id)
-    placeholders = dict(
-        flag_8=flags.flag_8,
-        flag_16=flags.flag_16,
-        flag_32=flags.flag_32,
-        name=get_current_user().name
-    )
-    capture = CaptureExec(script)
-    return bytes(capture.run(dict(PLACEHOLDERS=placeholders)), 'utf-8')
+            result = ScriptResult(None, str(e))
+            with lock:
+                status['error'] = f"{name}: {e}"
+        elapsed = time.time() - start
+        with lock:
+            stats = status['scripts'][script_id]
+            stats['runs'] += 1
+            stats['seconds'] += elapsed
+            stats['max_seconds'] = max(stats['max_seconds'], elapsed)
+            if result.error is not None:
+                stats['failures'] += 1
+                status['failed'] += 1
+            status['done'] += 1
+
+    def wait_for_runs(limit):
+        """ Waits until at most limit runs are pending, reporting progress at least every second """
+        while len(pending) > limit:
+            done, _ = wait(pending, timeout=1, return_when=FIRST_COMPLETED)
+            pending.difference_update(done)
+            with lock:
+                report()
+
+    try:
+        with ThreadPoolExecutor(max_workers=pool.workers) as executor:
+            for script in scripts:
+                code = get_script_code(script)
+                get_flags = _account_flags(script.challenge_id, teams_mode)
+                for user in users:
+                    placeholders = placeholder_values(get_flags(user), user.name)
+                    key = _generated_file_key(script, placeholders)
+                    if key in generated:
+                        with lock:
+                            status['cached'] += 1
+                            status['done'] += 1
+                        continue
+                    wait_for_runs(max_pending - 1)
+                    pending.add(executor.submit(run, str(script.id), code, script.name, key, placeholders))
+            wait_for_runs(0)
+    except Exception as e:
+        status['error'] = str(e)
+        raise
+    finally:
+        status['running'] = False
+        status['finished'] = time.time()
+        report(force=True)
+    return status
+
+def start_generated_file_warmup(script_ids: Optional[Iterable[int]] = None) -> bool:
+    """ Starts warm_generated_files in a background thread.
+    Returns false if a warm up is already running. """
+    with _script_pool_lock:
+        status = generated_file_warmup_status()
+        if status and status['running']:
+            return False
+        cache.set(WARMUP_STATUS_KEY, dict(running=True, updated=time.time()), timeout=0)
+
+    app = current_app._get_current_object()
+    def run():
+        with app.app_context():
+            try:
+                warm_generated_files(script_ids)
+            except Exception as e:
+                print("Exception when warming up generated files:", file=sys.stderr)
+                print(e, file=sys.stderr)
+    threading.Thread(target=run, daemon=True).start()
+    return True
+
+PROVISION_STATUS_KEY = "unique_challenges_flag_provisioning"
+
+_provision_lock = threading.Lock()
+
+def flag_provisioning_status() -> Optional[dict]:
+    """ Gets the progress of the current or last background provision_flags, if there has been one """
+    return _background_status(PROVISION_STATUS_KEY)
+
+def start_flag_provisioning(challenge_ids: Optional[Iterable[int]] = None) -> bool:
+    """ Starts provision_flags in a background thread, storing its progress for flag_provisioning_status.
+    Returns false if provisioning is already running. """
+    with _provision_lock:
+        status = flag_provisioning_status()
+        if status and status['running']:
+            return False
+        now = time.time()
+        status = dict(running=True, started=now, updated=now, finished=None, error=None,
+                      checked=0, total=None, created=0)
+        cache.set(PROVISION_STATUS_KEY, status, timeout=0)
+
+    def progress(checked, total, created):
+        status.update(updated=time.time(), checked=checked, total=total, created=created)
+        cache.set(PROVISION_STATUS_KEY, status, timeout=0)
+
+    app = current_app._get_current_object()
+    def run():
+        with app.app_context():
+            try:
+                provision_flags(challenge_ids, progress=progress)
+            except Exception as e:
+                status['error'] = str(e)
+                print("Exception when provisioning flags:", file=sys.stderr)
+                print(e, file=sys.stderr)
+            finally:
+                status.update(running=False, updated=time.time(), finished=time.time())
+                cache.set(PROVISION_STATUS_KEY, status, timeout=0)
+    threading.Thread(target=run, daemon=True).start()
+    return True
 
 def has_solved(challenge_id: int, user=None) -> bool:
     """ Checks if the given user has solved a challenge """
@@ -175,76 +872,818 @@ def has_solved(challenge_id: int, user=None) -> bool:
     ).first()
     return bool(solve)
 
-def meets_advanced_requirements(challenge_id: int, user=None) -> bool:
-    """ Checks if the given user meets the advanced requirements for a challenge """
-    model = UniqueChallengeRequirements.query.filter_by(challenge_id=challenge_id).first()
-    if user is None:
-        user = get_current_user()
-    if not model or not model.script or user.type == "admin":
-        # No requirements present = always allowed
-        return True
+CompiledRequirements = namedtuple('CompiledRequirements', ['program', 'hash', 'flips'])
+CompiledRequirements.__doc__ = """ A compiled requirement script. flips holds the sorted timestamps at which
+the script's result may change due to (before)/(after), or None if its result should not be cached. """
+
+def compile_requirements(challenge_id: int, script: bytes) -> CompiledRequirements:
+    """ Compiles the requirement script for a challenge, re-using a previous compile if possible. """
+    script_hash = hashlib.sha256(script).hexdigest()
+    key = (int(challenge_id), script_hash)
+    requirements = _requirements_cache.get(key)
+    if requirements is None:
+        lisp = LispIsh()
+        method = lisp.parse(script.decode('utf-8'))
+        requirements = CompiledRequirements(
+            lisp.compile(method, REQUIREMENT_FUNCTIONS, REQUIREMENT_FUNCTIONS),
+            script_hash,
+            _requirement_flips(method)
+        )
+        _requirements_cache.set(key, requirements)
+    return requirements
 
-    def completed(arg) -> bool:
+def invalidate_requirements(challenge_id: int):
+    """ Drops any cached compile of the given challenge's requirement script. """
+    challenge_id = int(challenge_id)
+    _requirements_cache.discard(lambda key: key[0] == challenge_id)
+
+def _timestamp(value, method='before') -> float:
+    if isinstance(value, int):
+        return value
+    for date_format in ("%Y-%m-%d", "%Y-%m-%d %H:%M"):
+        try:
+            return time.mktime(time.strptime(str(value), date_format))
+        except ValueError:
+            pass
+    raise LispIshRuntimeError(f"({method}) function was passed an invalid date string, expected an integer or a string with format YYYY-MM-DD or YYYY-MM-DD HH:MM")
+
+def _before(arg, method='before') -> bool:
+    if len(arg) != 1:
+        raise LispIshRuntimeError(f"({method}) function was passed {len(arg)} arguments, expected 1.")
+    return time.time() < _timestamp(arg[0], method)
+
+def _after(arg) -> bool:
+    return not _before(arg, 'after')
+
+def _requirement_flips(method: LispIshValue) -> Optional[Tuple[float, ...]]:
+    """ Finds every timestamp at which (before)/(after) may change their result.
+    Returns None if results can't be cached, either because a timestamp is computed
+    or because the script depends on the user's score, which changes without notice. """
+    if any(kind == 'score' for (kind, _, _) in extract_requirement_dependencies(method)):
+        return None
+    flips = set()
+    for value in method.walk():
+        if not isinstance(value, LispIshMethod) or value.canonical_name not in ('BEFORE', 'AFTER'):
+            continue
+        if len(value.args) != 1 or not isinstance(value.args[0], (LispIshNumber, LispIshString)):
+            return None
+        try:
+            flips.add(_timestamp(value.args[0].value))
+        except LispIshRuntimeError:
+            return None
+    return tuple(sorted(flips))
+
+def _evaluate_requirements(challenge_id: int, script: bytes, functions: LispIshMethods) -> Tuple[bool, Optional[float]]:
+    """ Evaluates a requirement script, treating any error as unmet requirements.
+    Returns the result along with the time it may be cached until, or None if it may not be cached. """
+    try:
+        requirements = compile_requirements(challenge_id, script)
+        result = requirements.program(functions)
+    except LispIshParseError as err:
+        print(f"Error parsing LispIsh: {err}")
+        return False, None
+    except LispIshRuntimeError as err:
+        print(f"Error evaluating LispIsh: {err}")
+        return False, None
+
+    if requirements.flips is None:
+        return result, None
+    now = time.time()
+    expires = now + REQUIREMENT_RESULT_TIMEOUT
+    for flip in requirements.flips:
+        if flip > now:
+            expires = min(expires, flip)
+            break
+    return result, expires
+
+class RequirementContext:
+    """ Snapshot of everything a requirement script can ask about a single user.
+    Each piece is loaded with a single query the first time a script needs it, so
+    any number of scripts can then be evaluated in memory. Use get_requirement_context
+    to share one snapshot between every evaluation in a request. """
+    def __init__(self, user):
+        self.user = user
+        self._solved = None
+        self._challenge_ids = None
+        self._cohort_ids = None
+        self._cohorts = None
+        self._score = None
+
+    @property
+    def solved(self) -> Set[int]:
+        """ Ids of the challenges solved by the user's account """
+        if self._solved is None:
+            self._solved = {
+                challenge_id for (challenge_id,) in
+                Solves.query.with_entities(Solves.challenge_id).filter_by(account_id=self.user.account_id)
+            }
+        return self._solved
+
+    @property
+    def challenge_ids(self) -> Dict[str, int]:
+        """ Maps challenge names to ids """
+        if self._challenge_ids is None:
+            # Mirror .filter_by(name=...).first() by letting the lowest id win for duplicate names.
+            self._challenge_ids = dict(reversed(
+                Challenges.query.with_entities(Challenges.name, Challenges.id).order_by(Challenges.id).all()
+            ))
+        return self._challenge_ids
+
+    @property
+    def cohort_ids(self) -> Dict[str, int]:
+        """ Maps cohort names to ids """
+        if self._cohort_ids is None:
+            self._cohort_ids = dict(reversed(
+                UniqueChallengeCohort.query.with_entities(UniqueChallengeCohort.name, UniqueChallengeCohort.id)
+                .order_by(UniqueChallengeCohort.id).all()
+            ))
+        return self._cohort_ids
+
+    @property
+    def cohorts(self) -> Set[int]:
+        """ Ids of the cohorts the user is a member of """
+        if self._cohorts is None:
+            self._cohorts = {
+                cohort_id for (cohort_id,) in
+                UniqueChallengeCohortMembership.query.with_entities(UniqueChallengeCohortMembership.cohort_id)
+                .filter_by(user_id=self.user.id)
+            }
+        return self._cohorts
+
+    @property
+    def score(self) -> int:
+        """ The user's score, which CTFd computes with a query on every access """
+        if self._score is None:
+            self._score = self.user.score
+        return self._score
+
+    def completed(self, arg) -> bool:
         for search in arg:
             if isinstance(search, str):
-                challenge = Challenges.query.filter_by(name=search).first()
-                if not challenge or not has_solved(challenge.id, user):
+                if self.challenge_ids.get(search) not in self.solved:
                     return False
             elif isinstance(search, int):
-                if not has_solved(search, user):
+                if search not in self.solved:
                     return False
             else:
                 raise LispIshRuntimeError(f"(completed) function was passed an argument that was not a string or int.")
         return True
 
-    def cohort(arg) -> bool:
+    def cohort(self, arg) -> bool:
         for search in arg:
             if isinstance(search, str):
-                cohort = UniqueChallengeCohort.query.filter_by(name=search).first()
-                if not cohort or not UniqueChallengeCohortMembership.query.filter_by(user_id=user.id, cohort_id=cohort.id).first():
+                if self.cohort_ids.get(search) not in self.cohorts:
                     return False
             elif isinstance(search, int):
-                if not UniqueChallengeCohortMembership.query.filter_by(user_id=user.id, cohort_id=search).first():
+                if search not in self.cohorts:
                     return False
             else:
                 raise LispIshRuntimeError(f"(cohort) function was passed an argument that was not a string or int.")
         return True
 
-    def before(arg, method='before') -> bool:
-        if len(arg) != 1:
-            raise LispIshRuntimeError(f"({method}) function was passed {len(arg)} arguments, expected 1.")
-        if isinstance(arg[0], int):
-            return time.time() < arg[0]
+    def functions(self) -> LispIshMethods:
+        """ Gets the function map used to evaluate requirement scripts for this user """
+        user = self.user
+        return {
+            'COMPLETED': self.completed,
+            'COHORT': self.cohort,
+            'BEFORE': _before,
+            'AFTER': _after,
+            'USER-EMAIL': lambda _: user.email,
+            'USER-NAME': lambda _: user.name,
+            'USER-ID': lambda _: user.id,
+            'USER-SCORE': lambda _: self.score,
+        }
+
+def get_requirement_context(user) -> RequirementContext:
+    """ Gets the requirement context for the given user, shared by every
+    requirement check made while handling the current request. """
+    contexts = g.setdefault('unique_requirement_contexts', {})
+    context = contexts.get(user.id)
+    if context is None:
+        context = contexts[user.id] = RequirementContext(user)
+    return context
+
+def _requirement_version_key(scope: str) -> str:
+    return f"unique_challenges_requirements_version_{scope}"
+
+def requirement_versions(scopes: List[str]) -> List[str]:
+    """ Gets the current version token for each scope, creating any which are missing.
+    Cached requirement results are only valid while the versions they were stored with are current. """
+    keys = [_requirement_version_key(scope) for scope in scopes]
+    versions = cache.get_many(*keys)
+    missing = {}
+    for i, key in enumerate(keys):
+        if versions[i] is None:
+            versions[i] = missing[key] = token_hex(4)
+    if missing:
+        cache.set_many(missing, timeout=0)
+    return versions
+
+def bump_requirement_versions(*scopes: str):
+    """ Invalidates every cached requirement result which depends on the given scopes.
+    Scopes are global (challenges or cohorts changed), user_<id> and team_<id>. """
+    cache.set_many({_requirement_version_key(scope): token_hex(4) for scope in scopes}, timeout=0)
+
+def _account_scopes(user_id: int, team_id: Optional[int]) -> List[str]:
+    """ Gets the requirement version scopes for an account. Users without a team have no team scope,
+    otherwise every such user would share one and any solve would invalidate all of them. """
+    if team_id is None:
+        return [f'user_{user_id}']
+    return [f'user_{user_id}', f'team_{team_id}']
+
+def _check_requirements(user, models) -> Dict[int, bool]:
+    """ Checks the given requirement scripts for a user, re-using cached results where possible """
+    keys = {model.challenge_id: f"unique_challenges_requirements_{model.challenge_id}_{user.id}" for model in models}
+    stamp = ':'.join(requirement_versions(['global', *_account_scopes(user.id, user.team_id)]))
+    cached = cache.get_many(*keys.values())
+    now = time.time()
+
+    results = {}
+    functions = None
+    for model, entry in zip(models, cached):
+        script_hash = hashlib.sha256(model.script).hexdigest()
+        if entry is not None and entry[0] == stamp and entry[1] == script_hash and now < entry[2]:
+            results[model.challenge_id] = entry[3]
+            continue
+
+        if functions is None:
+            functions = get_requirement_context(user).functions()
+        result, expires = _evaluate_requirements(model.challenge_id, model.script, functions)
+        results[model.challenge_id] = result
+        if expires is not None:
+            timeout = max(1, int(expires - now + 1))
+            cache.set(keys[model.challenge_id], (stamp, script_hash, expires, result), timeout=timeout)
+    return results
+
+def meets_advanced_requirements(challenge_id: int, user=None) -> bool:
+    """ Checks if the given user meets the advanced requirements for a challenge """
+    model = UniqueChallengeRequirements.query.filter_by(challenge_id=challenge_id).first()
+    if user is None:
+        user = get_current_user()
+    if not model or not model.script or user.type == "admin":
+        # No requirements present = always allowed
+        return True
+
+    return _check_requirements(user, [model])[model.challenge_id]
+
+def meets_advanced_requirements_many(challenge_ids: Iterable[int], user=None) -> Dict[int, bool]:
+    """ Checks the advanced requirements for many challenges at once. Uses a constant
+    number of queries regardless of how many challenges are checked.
+    Returns a dict mapping each challenge id to whether the user meets its requirements.
+    """
+    challenge_ids = [int(challenge_id) for challenge_id in challenge_ids]
+    results = dict.fromkeys(challenge_ids, True)
+    if user is None:
+        user = get_current_user()
+    if not challenge_ids or user.type == "admin":
+        return results
+
+    models = [
+        model for model in
+        UniqueChallengeRequirements.query.filter(UniqueChallengeRequirements.challenge_id.in_(challenge_ids)).all()
+        if model.script
+    ]
+    if models:
+        results.update(_check_requirements(user, models))
+    return results
+
+def _queue_requirement_bump(target, *scopes: str):
+    """ Bumps the given scopes once the session holding target commits, so that results
+    computed before the change is visible can't be stored under the new versions. """
+    session = object_session(target)
+    if session is None:
+        bump_requirement_versions(*scopes)
+        return
+    session.info.setdefault('unique_requirement_bumps', set()).update(scopes)
+
+def _on_submission_change(mapper, connection, target):
+    if target.type == 'correct':
+        _queue_requirement_bump(target, *_account_scopes(target.user_id, target.team_id))
+
+def _on_user_change(mapper, connection, target):
+    _queue_requirement_bump(target, f'user_{target.id}')
+
+def _on_challenge_change(mapper, connection, target):
+    _queue_requirement_bump(target, 'global')
+
+def _after_commit(session):
+    scopes = session.info.pop('unique_requirement_bumps', None)
+    if scopes:
+        bump_requirement_versions(*scopes)
+
+def _after_rollback(session):
+    session.info.pop('unique_requirement_bumps', None)
+
+def register_requirement_listeners():
+    """ Listens for changes which may change requirement results so cached results are dropped.
+    Changes made by bulk query deletes don't fire these events and must bump versions themselves. """
+    for event_name in ('after_insert', 'after_update', 'after_delete'):
+        for (model, listener) in [
+            (Submissions, _on_submission_change),
+            (Users, _on_user_change),
+            (Challenges, _on_challenge_change),
+        ]:
+            if not event.contains(model, event_name, listener):
+                event.listen(model, event_name, listener, propagate=True)
+    if not event.contains(db.session, 'after_commit', _after_commit):
+        event.listen(db.session, 'after_commit', _after_commit)
+        event.listen(db.session, 'after_rollback', _after_rollback)
+
+# Maps requirement functions to the kind of dependency they introduce.
+_DEPENDENCY_KINDS = {
+    'COMPLETED': 'challenge',
+    'COHORT': 'cohort',
+    'BEFORE': 'time',
+    'AFTER': 'time',
+    'USER-SCORE': 'score',
+    'USER-EMAIL': 'user',
+    'USER-NAME': 'user',
+    'USER-ID': 'user',
+}
+
+def extract_requirement_dependencies(method: LispIshValue) -> Set[Tuple[str, Optional[int], Optional[str]]]:
+    """ Statically finds everything a requirement script depends on.
+    Returns a set of (kind, target_id, target_name) tuples, see UniqueChallengeRequirementDependency.
+    """
+    dependencies = set()
+    for value in method.walk():
+        if not isinstance(value, LispIshMethod) or value.canonical_name not in _DEPENDENCY_KINDS:
+            continue
+        kind = _DEPENDENCY_KINDS[value.canonical_name]
+        if kind not in ('challenge', 'cohort'):
+            dependencies.add((kind, None, None))
+            continue
+        for arg in value.args:
+            if isinstance(arg, LispIshNumber):
+                dependencies.add((kind, arg.value, None))
+            elif isinstance(arg, LispIshString):
+                dependencies.add((kind, None, arg.value))
+            else:
+                dependencies.add((kind, None, None))
+    return dependencies
+
+def save_requirement_dependencies(challenge_id: int, script: str):
+    """ Replaces the stored dependencies for a challenge with those of the given script.
+    Does not commit the session. """
+    UniqueChallengeRequirementDependency.query.filter_by(challenge_id=challenge_id).delete()
+    if not script:
+        return
+    for (kind, target_id, target_name) in extract_requirement_dependencies(LispIsh().parse(script)):
+        db.session.add(UniqueChallengeRequirementDependency(
+            challenge_id=challenge_id,
+            kind=kind,
+            target_id=target_id,
+            target_name=target_name
+        ))
+
+def index_requirement_dependencies():
+    """ Extracts dependencies for any requirement script that was saved without them. """
+    indexed = {
+        challenge_id for (challenge_id,) in
+        UniqueChallengeRequirementDependency.query.with_entities(UniqueChallengeRequirementDependency.challenge_id).distinct()
+    }
+    for model in UniqueChallengeRequirements.query.all():
+        if model.challenge_id in indexed or not model.script:
+            continue
         try:
-            timestamp = time.strptime(str(arg[0]), "%Y-%m-%d")
-            return time.time() < time.mktime(timestamp)
-        except ValueError:
-            pass
+            save_requirement_dependencies(model.challenge_id, model.script.decode('utf-8'))
+        except LispIshParseError as err:
+            print(f"Error parsing LispIsh for challenge {model.challenge_id}: {err}")
+    db.session.commit()
+
+def dependent_challenges(kind: str, target_id: Optional[int] = None, target_name: Optional[str] = None) -> Set[int]:
+    """ Gets the ids of challenges whose requirements may change when the given dependency changes.
+    For challenge and cohort dependencies, pass the id and name of the changed challenge or cohort.
+    """
+    Dependency = UniqueChallengeRequirementDependency
+    query = Dependency.query.with_entities(Dependency.challenge_id).filter(Dependency.kind == kind)
+    if kind in ('challenge', 'cohort'):
+        query = query.filter(db.or_(
+            Dependency.target_id == target_id,
+            Dependency.target_name == target_name,
+            db.and_(Dependency.target_id.is_(None), Dependency.target_name.is_(None))
+        ))
+    return {challenge_id for (challenge_id,) in query.distinct()}
+
+def _audit_flags(challenge_id: int, teams_mode: bool, accounts: Optional[List[int]], secret: Optional[bytes]):
+    """ Gets the flags of every account for a challenge as audit.FlagRow tuples. If accounts and secret
+    are given, derived flags are included for the accounts without stored flags. """
+    flags = (
+        UniqueFlags.query
+        .with_entities(UniqueFlags.challenge_id, UniqueFlags.user_id, UniqueFlags.team_id,
+                       UniqueFlags.flag_8, UniqueFlags.flag_16, UniqueFlags.flag_32)
+        .filter(UniqueFlags.challenge_id == challenge_id)
+        .all()
+    )
+    if secret is not None:
+        stored = {flag_tid if teams_mode else flag_uid for (_, flag_uid, flag_tid, *_) in flags}
+        flags.extend(
+            derive_flags(challenge_id, team_id=account_id, secret=secret) if teams_mode
+            else derive_flags(challenge_id, user_id=account_id, secret=secret)
+            for account_id in accounts if account_id not in stored
+        )
+    return flags
+
+def find_flag_leaks(after_id: int = 0, up_to_id: Optional[int] = None,
+                    progress: Optional[Callable[[int, int], None]] = None) -> Iterator[AuditRow]:
+    """ Finds incorrect submissions containing another account's flags, see audit.py.
+    Only submissions with after_id < id <= up_to_id are checked.
+    In derived mode, accounts without stored flags are checked against their derived flags.
+    Matching ignores case, like the INSTR query this replaced did under MySQL's default collation.
+    Yields (challenge_id, submission_id, user_id, team_id, flag user_id, flag team_id) like the old audit query.
+    If given, progress is called with the number of challenges checked and the total after each challenge.
+    """
+    teams_mode = config.is_teams_mode()
+    accounts, secret = None, None
+    if flag_mode() == "derived":
+        secret = _flag_secret()
+        if teams_mode:
+            accounts = [team_id for (team_id,) in Teams.query.with_entities(Teams.id)]
+        else:
+            accounts = [user_id for (user_id,) in Users.query.with_entities(Users.id).filter(Users.type != 'admin')]
+
+    new_submissions = Submissions.query.filter(Submissions.type == "incorrect", Submissions.id > after_id)
+    if up_to_id is not None:
+        new_submissions = new_submissions.filter(Submissions.id <= up_to_id)
+    challenge_ids = [
+        challenge_id for (challenge_id,) in
+        new_submissions
+        .with_entities(Submissions.challenge_id)
+        .join(UniqueChallenges, UniqueChallenges.id == Submissions.challenge_id)
+        .distinct()
+    ]
+    for checked, challenge_id in enumerate(challenge_ids, 1):
+        submissions = (
+            new_submissions
+            .with_entities(Submissions.challenge_id, Submissions.id, Submissions.user_id,
+                           Submissions.team_id, Submissions.provided)
+            .filter(Submissions.challenge_id == challenge_id)
+            .all()
+        )
+        yield from audit_challenge(_audit_flags(challenge_id, teams_mode, accounts, secret), submissions)
+        if progress:
+            progress(checked, len(challenge_ids))
+
+# The id of the last submission which has been audited, see _update_audit_findings.
+AUDIT_HIGH_WATER_KEY = "unique_challenges_audit_submission_id"
+# Held while updating audit findings, so concurrent updates don't record findings twice.
+# It expires if the update stops renewing it for WARMUP_STALE_SECONDS, for example because its worker was killed.
+AUDIT_LOCK_KEY = "unique_challenges_audit_lock"
+# Progress of the current or last audit update, see start_audit_update.
+AUDIT_STATUS_KEY = "unique_challenges_audit_status"
+# How long after an update finishes viewing the audit may start another, see request_audit_update.
+AUDIT_UPDATE_INTERVAL_SECONDS = 10
+# How old a submission must be before the high water mark moves past it, see _update_audit_findings.
+AUDIT_SETTLE_SECONDS = 60
+
+# How often a live flag index may query for new flags, see LiveFlagIndex.
+LIVE_AUDIT_REFRESH_SECONDS = 5
+
+class LiveFlagIndex:
+    """ The flags of every account for one challenge, kept in memory by each worker so that
+    incorrect submissions can be checked for other accounts' flags as they are made.
+    New flags are added by querying for rows newer than the last one seen. That only happens when a
+    submission looks like it could contain a flag but matches none, at most every LIVE_AUDIT_REFRESH_SECONDS,
+    so most submissions cost a lookup per character and no queries. Anything missed in between is
+    still found by the next audit update, see start_audit_update.
+    """
+    def __init__(self, challenge_id: int, teams_mode: bool, secret: Optional[bytes]):
+        self._challenge_id = challenge_id
+        self._teams_mode = teams_mode
+        self._secret = secret
+        self._index = AccountFlagIndex()
+        self._stored: Set[int] = set()
+        # Flags may commit after flags with higher ids, so ids above _settled_id are queried again
+        # until AUDIT_SETTLE_SECONDS have passed, with _recent preventing them being added twice.
+        self._settled_id = 0
+        self._recent: Set[int] = set()
+        self._checkpoints: List[Tuple[float, int]] = []
+        self._account_id = 0
+        self._refreshed = 0.0
+        self._lock = threading.Lock()
+        with self._lock:
+            self._refresh()
+
+    def approximate_bytes(self) -> int:
+        return self._index.approximate_bytes()
+
+    def _refresh(self):
+        """ Adds flags stored since the last refresh and, with a secret, derived flags for new accounts. """
+        flags = (
+            UniqueFlags.query
+            .with_entities(UniqueFlags.id, UniqueFlags.challenge_id, UniqueFlags.user_id, UniqueFlags.team_id,
+                           UniqueFlags.flag_8, UniqueFlags.flag_16, UniqueFlags.flag_32)
+            .filter(UniqueFlags.challenge_id == self._challenge_id, UniqueFlags.id > self._settled_id)
+            .order_by(UniqueFlags.id)
+        )
+        for (flag_id, *flag) in flags:
+            if flag_id in self._recent:
+                continue
+            self._index.add(tuple(flag))
+            self._stored.add(flag[2] if self._teams_mode else flag[1])
+            self._recent.add(flag_id)
+            if len(self._recent) % 1000 == 0:
+                time.sleep(0)  # Lets other greenlets run under gevent while a large index is built.
+
+        now = time.monotonic()
+        self._checkpoints.append((now, max(self._recent, default=self._settled_id)))
+        while self._checkpoints and now - self._checkpoints[0][0] > AUDIT_SETTLE_SECONDS:
+            self._settled_id = self._checkpoints.pop(0)[1]
+        self._recent = {flag_id for flag_id in self._recent if flag_id > self._settled_id}
+
+        if self._secret is not None:
+            if self._teams_mode:
+                accounts = Teams.query.with_entities(Teams.id).filter(Teams.id > self._account_id).order_by(Teams.id)
+            else:
+                accounts = (
+                    Users.query.with_entities(Users.id)
+                    .filter(Users.id > self._account_id, Users.type != 'admin')
+                    .order_by(Users.id)
+                )
+            # Accounts given stored flags after their derived flags were added keep both, which is harmless.
+            for (account_id,) in accounts:
+                if account_id not in self._stored:
+                    self._index.add(
+                        derive_flags(self._challenge_id, team_id=account_id, secret=self._secret) if self._teams_mode
+                        else derive_flags(self._challenge_id, user_id=account_id, secret=self._secret)
+                    )
+                    if len(self._index) % 1000 == 0:
+                        time.sleep(0)
+                self._account_id = account_id
+        self._refreshed = time.monotonic()
+
+    def sources(self, provided: str, user_id: Optional[int], team_id: Optional[int]) -> List[Tuple[Optional[int], Optional[int]]]:
+        """ Gets the (user_id, team_id) of the other accounts whose flags are in provided """
+        with self._lock:
+            found = self._index.sources(provided, user_id, team_id)
+            if (not found and time.monotonic() - self._refreshed > LIVE_AUDIT_REFRESH_SECONDS
+                    and FLAG_CANDIDATE_REGEX.search(provided)):
+                self._refresh()
+                found = self._index.sources(provided, user_id, team_id)
+            return found
+
+def get_live_flag_indexes() -> LRUCache:
+    """ Gets the live flag indexes of this worker, bounded by their approximate memory use.
+    The limit is configured with the UNIQUE_CHALLENGES_LIVE_AUDIT_BYTES app config or environment setting. """
+    global _live_flag_indexes
+    with _live_flag_index_lock:
+        if _live_flag_indexes is None:
+            _live_flag_indexes = LRUCache(
+                maxsize=int(storage_setting('UNIQUE_CHALLENGES_LIVE_AUDIT_BYTES', 64 * 1024 * 1024)),
+                sizeof=LiveFlagIndex.approximate_bytes
+            )
+        return _live_flag_indexes
+
+def _build_live_flag_index(key: tuple):
+    """ Builds a live flag index in a background thread, so that a submission never waits for one """
+    with _live_flag_index_lock:
+        if key in _live_flag_index_builds:
+            return
+        _live_flag_index_builds.add(key)
+    (challenge_id, teams_mode, mode) = key
+    indexes = get_live_flag_indexes()
+    secret = _flag_secret() if mode == "derived" else None
+    app = current_app._get_current_object()
+
+    def run():
         try:
-            timestamp = time.strptime(str(arg[0]), "%Y-%m-%d %H:%M")
-            return time.time() < time.mktime(timestamp)
-        except ValueError:
-            raise LispIshRuntimeError(f"({method}) function was passed an invalid date string, expected an integer or a string with format YYYY-MM-DD or YYYY-MM-DD HH:MM")
+            with app.app_context():
+                indexes.set(key, LiveFlagIndex(challenge_id, teams_mode, secret))
+        except Exception as e:
+            print("Exception when building a live flag index:", file=sys.stderr)
+            print(e, file=sys.stderr)
+        finally:
+            with _live_flag_index_lock:
+                _live_flag_index_builds.discard(key)
+    threading.Thread(target=run, daemon=True).start()
+
+def record_flag_leaks(submission) -> int:
+    """ Checks an incorrect submission for other accounts' flags, adding what is found to
+    unique_audit_findings in the current transaction. The submission must have been flushed so it has an id.
+    If this worker has no index for the challenge yet, one is built in the background and the submission
+    is left for the next audit update, see _update_audit_findings, which keeps these findings when it
+    finds them again, so committing them with the submission means they are never recorded twice.
+    Returns the number of findings.
+    """
+    if not submission.provided:
+        return 0
+    key = (submission.challenge_id, config.is_teams_mode(), flag_mode())
+    indexes = get_live_flag_indexes()
+    index = indexes.get(key)
+    if index is None:
+        _build_live_flag_index(key)
+        return 0
 
-    def after(arg) -> bool:
-        return not before(arg, 'after')
+    size = index.approximate_bytes()
+    sources = index.sources(submission.provided, submission.user_id, submission.team_id)
+    if index.approximate_bytes() != size:
+        # The index refreshed and grew, which the cache only counts if told.
+        indexes.resize(key)
+    if sources:
+        db.session.execute(UniqueAuditFinding.__table__.insert(), [
+            dict(
+                challenge_id=submission.challenge_id, submission_id=submission.id,
+                user_id=submission.user_id, team_id=submission.team_id,
+                source_user_id=uf_uid, source_team_id=uf_tid
+            )
+            for (uf_uid, uf_tid) in sources
+        ])
+    return len(sources)
 
-    lisp = LispIsh()
-    try:
-        method = lisp.parse(model.script.decode('utf-8'))
-        return method.evaluate({
-            'COMPLETED': completed,
-            'COHORT': cohort,
-            'BEFORE': before,
-            'AFTER': after,
-            'USER-EMAIL': lambda _: user.email,
-            'USER-NAME': lambda _: user.name,
-            'USER-ID': lambda _: user.id,
-            'USER-SCORE': lambda _: user.score,
-        })
-    except LispIshParseError as err:
-        print(f"Error parsing LispIsh: {err}")
-        return False
-    except LispIshRuntimeError as err:
-        print(f"Error evaluating LispIsh: {err}")
+def invalidate_live_flag_index(challenge_id: int):
+    get_live_flag_indexes().discard(lambda key: key[0] == challenge_id)
+
+def audit_status() -> Optional[dict]:
+    """ Gets the progress of the current or last audit update, if there has been one """
+    return _background_status(AUDIT_STATUS_KEY)
+
+def start_audit_update(rebuild: bool = False, batch_size: int = 1000) -> bool:
+    """ Starts auditing submissions in a background thread, storing its progress for audit_status.
+    Only submissions made since the last update are audited, see _update_audit_findings, unless rebuild
+    is set, in which case every finding is discarded and every submission is audited again.
+    Returns false if an update is already running, in which case nothing is done.
+    """
+    # Taken here rather than by the thread, so that only one worker's update writes its status.
+    if not cache.add(AUDIT_LOCK_KEY, True, timeout=WARMUP_STALE_SECONDS):
         return False
+    now = time.time()
+    status = dict(running=True, rebuild=rebuild, started=now, updated=now, finished=None, error=None,
+                  checked=0, total=None, found=0)
+    cache.set(AUDIT_STATUS_KEY, status, timeout=0)
+
+    def progress(checked, total, found):
+        status.update(updated=time.time(), checked=checked, total=total, found=found)
+        cache.set(AUDIT_STATUS_KEY, status, timeout=0)
+        cache.set(AUDIT_LOCK_KEY, True, timeout=WARMUP_STALE_SECONDS)
+
+    app = current_app._get_current_object()
+    def run():
+        with app.app_context():
+            try:
+                if rebuild:
+                    # The lock is held throughout, so an update can't write its old high water mark over the reset.
+                    UniqueAuditFinding.query.delete()
+                    db.session.commit()
+                    set_config(AUDIT_HIGH_WATER_KEY, 0)
+                _update_audit_findings(batch_size, progress)
+            except Exception as e:
+                status['error'] = str(e)
+                print("Exception when auditing submissions:", file=sys.stderr)
+                print(e, file=sys.stderr)
+            finally:
+                cache.delete(AUDIT_LOCK_KEY)
+                status.update(running=False, updated=time.time(), finished=time.time())
+                cache.set(AUDIT_STATUS_KEY, status, timeout=0)
+    threading.Thread(target=run, daemon=True).start()
+    return True
+
+def request_audit_update() -> Optional[dict]:
+    """ Starts updating the audit findings in the background unless an update is running or finished in the
+    last AUDIT_UPDATE_INTERVAL_SECONDS, so that reloading the audit once an update finishes doesn't start
+    another straight away. Returns audit_status. """
+    status = audit_status()
+    if not status or (not status['running']
+                      and time.time() - (status['finished'] or 0) > AUDIT_UPDATE_INTERVAL_SECONDS):
+        start_audit_update()
+        status = audit_status()
+    return status
+
+def _update_audit_findings(batch_size: int, progress: Callable[[int, int, int], None]):
+    """ Audits submissions made since the last update, recording what is found in unique_audit_findings,
+    so the cost of an update depends on the number of new submissions rather than all of them.
+    Submissions from the last AUDIT_SETTLE_SECONDS are audited by every update, in case a submission
+    with a lower id hasn't committed yet. The caller must hold AUDIT_LOCK_KEY.
+    progress is called with the challenges checked, the total and the findings so far.
+    """
+    after_id = int(get_config(AUDIT_HIGH_WATER_KEY, 0) or 0)
+    up_to_id = db.session.query(db.func.max(Submissions.id)).scalar()
+    if up_to_id is None or up_to_id <= after_id:
+        return
+
+    # Findings already recorded for these submissions, by the live audit or an update whose high water mark
+    # didn't pass them, are kept rather than inserted again so that their ids, which the audit page's
+    # cursors refer to, don't change. Findings which aren't found again are removed.
+    existing = {}
+    for (finding_id, *row) in (
+        UniqueAuditFinding.query
+        .with_entities(UniqueAuditFinding.id, UniqueAuditFinding.challenge_id, UniqueAuditFinding.submission_id,
+                       UniqueAuditFinding.user_id, UniqueAuditFinding.team_id,
+                       UniqueAuditFinding.source_user_id, UniqueAuditFinding.source_team_id)
+        .filter(UniqueAuditFinding.submission_id > after_id, UniqueAuditFinding.submission_id <= up_to_id)
+    ):
+        existing.setdefault(tuple(row), []).append(finding_id)
+    pending = []
+    found = 0
+    leaks = find_flag_leaks(after_id, up_to_id, lambda checked, total: progress(checked, total, found))
+    for leak in leaks:
+        found += 1
+        ids = existing.get(leak)
+        if ids:
+            ids.pop()
+            continue
+        (c_id, sub_id, sub_uid, sub_tid, uf_uid, uf_tid) = leak
+        pending.append(dict(
+            challenge_id=c_id, submission_id=sub_id, user_id=sub_uid, team_id=sub_tid,
+            source_user_id=uf_uid, source_team_id=uf_tid
+        ))
+        if len(pending) >= batch_size:
+            db.session.execute(UniqueAuditFinding.__table__.insert(), pending)
+            pending.clear()
+    if pending:
+        db.session.execute(UniqueAuditFinding.__table__.insert(), pending)
+    removed = [finding_id for ids in existing.values() for finding_id in ids]
+    # Each id is a bound parameter, so these are limited like an insert of one column.
+    step = rows_per_insert(1, batch_size)
+    for start in range(0, len(removed), step):
+        UniqueAuditFinding.query.filter(
+            UniqueAuditFinding.id.in_(removed[start:start + step])
+        ).delete(synchronize_session=False)
+    db.session.commit()
+
+    # Ids are allocated when a submission is inserted, not when it commits, so a submission can become
+    # visible after one with a higher id. Only submissions old enough that they must have committed are
+    # passed, and newer ones are audited again next time, which adds any findings that were missed.
+    settled = datetime.datetime.utcnow() - datetime.timedelta(seconds=AUDIT_SETTLE_SECONDS)
+    high_water = (
+        db.session.query(db.func.max(Submissions.id))
+        .filter(Submissions.id > after_id, Submissions.id <= up_to_id, Submissions.date < settled)
+        .scalar()
+    )
+    if high_water is not None:
+        set_config(AUDIT_HIGH_WATER_KEY, high_water)
+
+def audit_sort_columns(sort: str) -> list:
+    """ Gets the columns unique_audit_findings is ordered by for the given audit grouping.
+    Every column is non-null and the last is unique, so they can be used for keyset pagination,
+    and each ordering has a matching index on unique_audit_findings.
+    Groups are ordered by id rather than name so that pages are index range scans. """
+    teams_mode = config.is_teams_mode()
+    if sort == 'submit':
+        account = UniqueAuditFinding.team_id if teams_mode else UniqueAuditFinding.user_id
+        return [account, UniqueAuditFinding.challenge_id, UniqueAuditFinding.id]
+    if sort == 'copied':
+        source = UniqueAuditFinding.source_team_id if teams_mode else UniqueAuditFinding.source_user_id
+        return [source, UniqueAuditFinding.id]
+    return [UniqueAuditFinding.challenge_id, UniqueAuditFinding.user_id, UniqueAuditFinding.id]
+
+def _after_cursor(columns: list, values: list):
+    """ Builds (a, b, c) > (x, y, z) without row value comparisons, which not every database can index """
+    clauses = []
+    for i, column in enumerate(columns):
+        equal = [columns[j] == values[j] for j in range(i)]
+        clauses.append(db.and_(*equal, column > values[i]))
+    return db.or_(*clauses)
+
+def encode_audit_cursor(values: list) -> str:
+    return base64.urlsafe_b64encode(bytes(json.dumps(values), 'utf-8')).decode('ascii')
+
+def decode_audit_cursor(cursor: str) -> list:
+    """ Decodes a cursor from encode_audit_cursor, raising ValueError if it is invalid """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(bytes(cursor, 'ascii')))
+    except (ValueError, UnicodeEncodeError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+    if not isinstance(values, list) or not all(isinstance(value, int) for value in values):
+        raise ValueError("Invalid cursor")
+    return values
+
+def audit_findings_page(sort: str = 'challenge', cursor: Optional[str] = None, limit: int = 100,
+                        challenge_id: Optional[int] = None, user_id: Optional[int] = None,
+                        team_id: Optional[int] = None, cohort_id: Optional[int] = None):
+    """ Gets a page of audit findings, sorted by the given grouping and starting after cursor.
+    The user and team filters match either the submitting or copied account, the cohort filter
+    matches the submitting user. Returns (rows, next cursor or None) where rows are
+    (finding, challenge name) pairs. Raises ValueError if the cursor is invalid.
+    """
+    columns = audit_sort_columns(sort)
+    query = (
+        db.session.query(UniqueAuditFinding, Challenges.name)
+        .join(Challenges, Challenges.id == UniqueAuditFinding.challenge_id)
+    )
+    if challenge_id is not None:
+        query = query.filter(UniqueAuditFinding.challenge_id == challenge_id)
+    if user_id is not None:
+        query = query.filter(db.or_(UniqueAuditFinding.user_id == user_id,
+                                    UniqueAuditFinding.source_user_id == user_id))
+    if team_id is not None:
+        query = query.filter(db.or_(UniqueAuditFinding.team_id == team_id,
+                                    UniqueAuditFinding.source_team_id == team_id))
+    if cohort_id is not None:
+        query = query.filter(UniqueAuditFinding.user_id.in_(
+            db.session.query(UniqueChallengeCohortMembership.user_id)
+            .filter(UniqueChallengeCohortMembership.cohort_id == cohort_id)
+        ))
+    if cursor:
+        values = decode_audit_cursor(cursor)
+        if len(values) != len(columns):
+            raise ValueError("Invalid cursor")
+        query = query.filter(_after_cursor(columns, values))
+
+    # Fetch one extra row to find out if there is another page.
+    rows = query.order_by(*columns).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1][0]
+    return rows, encode_audit_cursor([getattr(last, column.key) for column in columns])
@@ -6,7 +6,7 @@ LispIsh - a simple lisp-like language.
 >>> expression.evaluate({ 'XOR': lambda v: v[0] ^ v[1] })
 3
 
-Some functions are built in. See the _defaults dict below for which ones.
+Some functions are built in. See the _defaults and _special_forms dicts below for which ones.
 
 >>> expression = compiler.parse('(= 5 6)')
 >>> expression.evaluate({})
@@ -18,6 +18,13 @@ True
 >>> expression.evaluate({})
 6
 
+The logical functions (and), (or) and (not) only evaluate as many arguments as
+needed to determine their result.
+
+>>> expression = compiler.parse('(or 1 (missing))')
+>>> expression.evaluate({})
+True
+
 Errors may be raised when parsing or when evaluating. If the parse string is
 not valid, an instance of LispIshParseError will be raised. When evaluating,
 if a function does not exist, an instance of LispIshRuntimeError will be raised.
@@ -33,16 +40,37 @@ Parse names are case-insensitive. (xor 1 2) === (XOR 1 2)
 When emitting parsed code, indentation may not be preserved, but method name case
 will be preserved.
 
+Parsed expressions can also be compiled into a native Python closure. Built in
+functions are resolved once at compile time, names listed as externals are looked
+up in the function map passed when calling the compiled expression.
+
+>>> program = compiler.compile(compiler.parse('(xor 5 (+ 1 2))'), ['XOR'])
+>>> program({ 'XOR': lambda v: v[0] ^ v[1] })
+6
+
+When compiling, a cost may be given for each function. The arguments of (and)
+and (or) will then be evaluated cheapest first.
+
+>>> calls = []
+>>> functions = { 'SLOW': lambda v: calls.append('slow'), 'FAST': lambda v: calls.append('fast') }
+>>> program = compiler.compile(compiler.parse('(and (slow) (fast))'), functions, { 'SLOW': 10 })
+>>> program(functions)
+False
+>>> calls
+['fast']
+
 This is used to store the internal representation of challenge requirements.
 """
 
-from typing import List, Dict, Callable, Union, NoReturn
+from typing import List, Dict, Callable, Union, NoReturn, FrozenSet, Iterable, Iterator, Optional
 import json
 import string
 from functools import wraps
 
 LispIshTypes = Union[str, int, bool]
 LispIshMethods = Dict[str, Callable[[List[LispIshTypes]], LispIshTypes]]
+LispIshCompiled = Callable[[LispIshMethods], LispIshTypes]
+LispIshCosts = Optional[Dict[str, int]]
 
 def _get_indent(size: int) -> str:
     """ Helper to get indented code
@@ -84,6 +112,19 @@ class LispIshValue:
         """ Evaluate this value, resulting in some python type """
         raise NotImplementedError()
 
+    def compile(self, externals: FrozenSet[str], costs: LispIshCosts = None) -> LispIshCompiled:
+        """ Compile this value into a closure which takes the function map for the
+        given externals and evaluates the value """
+        raise NotImplementedError()
+
+    def cost(self, costs: Dict[str, int]) -> int:
+        """ Estimate the cost of evaluating this value, functions without a cost are assumed to cost 1 """
+        return 0
+
+    def walk(self) -> Iterator['LispIshValue']:
+        """ Iterate over this value and every value nested within it, parents first """
+        yield self
+
 class LispIshNumber(LispIshValue):
     """ Type safe container for an int represented in the source """
     def __init__(self, value: int):
@@ -93,6 +134,10 @@ class LispIshNumber(LispIshValue):
     def evaluate(self, function_map: LispIshMethods) -> LispIshTypes:
         return self.value
 
+    def compile(self, externals: FrozenSet[str], costs: LispIshCosts = None) -> LispIshCompiled:
+        value = self.value
+        return lambda function_map: value
+
     def emit(self, indent: int = 0) -> str:
         return _get_indent(indent) + f"{self.value}"
 
@@ -105,6 +150,10 @@ class LispIshString(LispIshValue):
     def evaluate(self, function_map: LispIshMethods) -> LispIshTypes:
         return self.value
 
+    def compile(self, externals: FrozenSet[str], costs: LispIshCosts = None) -> LispIshCompiled:
+        value = self.value
+        return lambda function_map: value
+
     def emit(self, indent: int = 0) -> str:
         """ Emit a string, try to avoid escaping quotes.
         >>> LispIshString("hi there").emit()
@@ -130,12 +179,67 @@ class LispIshMethod(LispIshValue):
             return function_map[self.canonical_name]([
                 arg.evaluate(function_map) for arg in self.args
             ])
+        if self.canonical_name in _special_forms:
+            return _special_forms[self.canonical_name](
+                self.args, lambda arg: arg.evaluate(function_map)
+            )
         if self.canonical_name in _defaults:
             return _defaults[self.canonical_name]([
                 arg.evaluate(function_map) for arg in self.args
             ])
         raise LispIshRuntimeError(f"The method <{self.name}> is not defined.")
 
+    def cost(self, costs: Dict[str, int]) -> int:
+        return costs.get(self.canonical_name, 1) + sum(arg.cost(costs) for arg in self.args)
+
+    def walk(self) -> Iterator[LispIshValue]:
+        """ Walk the call tree.
+        >>> lisp = LispIsh()
+        >>> [type(value).__name__ for value in lisp.parse("(a 1 (b 'c'))").walk()]
+        ['LispIshMethod', 'LispIshNumber', 'LispIshMethod', 'LispIshString']
+        """
+        yield self
+        for arg in self.args:
+            yield from arg.walk()
+
+    def compile(self, externals: FrozenSet[str], costs: LispIshCosts = None) -> LispIshCompiled:
+        """ Compile a method call, resolving the function as early as possible.
+        >>> lisp = LispIsh()
+        >>> lisp.compile(lisp.parse("(- 5 (- 1))"))({})
+        6
+        >>> lisp.compile(lisp.parse("(missing)"))({})  # doctest: +IGNORE_EXCEPTION_DETAIL
+        Traceback (most recent call last):
+            ...
+        LispIshRuntimeError: The method <missing> is not defined.
+        """
+        name = self.canonical_name
+        if name in externals:
+            evaluate_args = _compile_args(self.args, externals, costs)
+            def call_external(function_map: LispIshMethods) -> LispIshTypes:
+                return function_map[name](evaluate_args(function_map))
+            return call_external
+        if name in _special_forms:
+            form = _special_forms[name]
+            args = self.args
+            if costs is not None and name != 'NOT':
+                # Stable, so equally expensive arguments keep their source order.
+                args = sorted(args, key=lambda arg: arg.cost(costs))
+            compiled = [arg.compile(externals, costs) for arg in args]
+            def call_special(function_map: LispIshMethods) -> LispIshTypes:
+                return form(compiled, lambda arg: arg(function_map))
+            return call_special
+        if name in _defaults:
+            function = _defaults[name]
+            evaluate_args = _compile_args(self.args, externals, costs)
+            def call_default(function_map: LispIshMethods) -> LispIshTypes:
+                return function(evaluate_args(function_map))
+            return call_default
+        # Only an error if actually called, just like evaluate.
+        message = f"The method <{self.name}> is not defined."
+        def call_missing(function_map: LispIshMethods) -> LispIshTypes:
+            raise LispIshRuntimeError(message)
+        return call_missing
+
     def emit(self, indent: int = 0) -> str:
         r""" Smart emit that doesn't cause unnecessary indentation but is readable.
         >>> lisp = LispIsh()
@@ -156,14 +260,55 @@ class LispIshMethod(LispIshValue):
             f"{self.args[-1].emit(indent + 1)})"
         ])
 
+def _compile_args(args: List[LispIshValue], externals: FrozenSet[str],
+                  costs: LispIshCosts) -> Callable[[LispIshMethods], List[LispIshTypes]]:
+    """ Compiles a list of arguments into a closure which builds the evaluated argument list.
+    Common arities are unrolled and literal-only argument lists skip evaluation entirely.
+    """
+    if all(isinstance(arg, (LispIshNumber, LispIshString)) for arg in args):
+        values = [arg.value for arg in args]
+        return lambda function_map: list(values)
+    compiled = [arg.compile(externals, costs) for arg in args]
+    if len(compiled) == 1:
+        first, = compiled
+        return lambda function_map: [first(function_map)]
+    if len(compiled) == 2:
+        first, second = compiled
+        return lambda function_map: [first(function_map), second(function_map)]
+    return lambda function_map: [arg(function_map) for arg in compiled]
+
 def _assertArgs(arg, num: int, name: str):
     if len(arg) < num:
         raise LispIshRuntimeError(f"({name}) was passed {len(arg)} arguments, expected at least {num}.")
 
-def _notFn(arg) -> bool:
-    if len(arg) != 1:
-        raise LispIshRuntimeError(f"(not) function was passed {len(arg)} arguments, expected 1.")
-    return not arg[0]
+def _notForm(args, evaluate) -> bool:
+    if len(args) != 1:
+        raise LispIshRuntimeError(f"(not) function was passed {len(args)} arguments, expected 1.")
+    return not evaluate(args[0])
+
+def _andForm(args, evaluate) -> bool:
+    """ Checks if every arg is truthy, stopping at the first that is not.
+    >>> _andForm([1, 0, 'not evaluated'], bool)
+    False
+    >>> _andForm([], bool)
+    True
+    """
+    for arg in args:
+        if not evaluate(arg):
+            return False
+    return True
+
+def _orForm(args, evaluate) -> bool:
+    """ Checks if any arg is truthy, stopping at the first that is.
+    >>> _orForm([0, 1, 'not evaluated'], bool)
+    True
+    >>> _orForm([], bool)
+    False
+    """
+    for arg in args:
+        if evaluate(arg):
+            return True
+    return False
 
 # Note: Not limited to numbers.
 def _eqFn(arg) -> bool:
@@ -259,10 +404,14 @@ def _minFn(arg) -> bool:
     _assertArgs(arg, 1, 'min')
     return min(arg)
 
+# Special forms are passed their unevaluated arguments along with a function to evaluate them.
+_special_forms = {
+    'NOT': _notForm,
+    'AND': _andForm,
+    'OR': _orForm,
+}
+
 _defaults = {
-    'NOT': _notFn,
-    'AND': all,
-    'OR': any,
     '=': _eqFn,
     '/=': _neqFn,
     '>': _gtFn,
@@ -297,6 +446,19 @@ class LispIsh:
         self._expect_eof()
         return method
 
+    def compile(self, value: LispIshValue, externals: Iterable[str] = (), costs: LispIshCosts = None) -> LispIshCompiled:
+        """ Compile a parsed value into a closure. Function names in externals will be
+        looked up in the function map passed to the closure, all others must be built in.
+        If costs are given, (and) and (or) will evaluate their cheapest arguments first.
+        >>> lisp = LispIsh()
+        >>> program = lisp.compile(lisp.parse("(double (max 2 7))"), ["double"])
+        >>> program({ "DOUBLE": lambda x: x[0] * 2 })
+        14
+        """
+        if costs is not None:
+            costs = { name.upper(): cost for name, cost in costs.items() }
+        return value.compile(frozenset(name.upper() for name in externals), costs)
+
     def _die(self, message: str) -> NoReturn:
         raise LispIshParseError(message, self.line, self.col)
 
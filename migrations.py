@@ -0,0 +1,162 @@
+"""
+Brings databases created by older versions of this plugin up to date.
+db.create_all only creates missing tables, so changes to existing tables are made here.
+"""
+
+import hashlib
+
+from sqlalchemy import inspect, text
+
+from CTFd.models import db
+
+from .models import (
+    UniqueFlags,
+    UniqueChallengeFiles,
+    UniqueChallengeFilePlaceholder,
+    UniqueChallengeScript,
+    UniqueAuditFinding,
+)
+from .storage import content_size
+
+
+def _ensure_unique_flags_constraints(inspector):
+    """ Removes duplicate flags created before unique_flags had unique constraints, keeping
+    the oldest set for each account, then adds the constraints as unique indexes. """
+    existing = {tuple(c['column_names']) for c in inspector.get_unique_constraints('unique_flags')}
+    existing |= {tuple(i['column_names']) for i in inspector.get_indexes('unique_flags') if i['unique']}
+
+    for (name, column) in [
+        ('unique_flags_challenge_user', UniqueFlags.user_id),
+        ('unique_flags_challenge_team', UniqueFlags.team_id),
+    ]:
+        if ('challenge_id', column.name) in existing:
+            continue
+        duplicates = (
+            db.session.query(UniqueFlags.challenge_id, column, db.func.min(UniqueFlags.id))
+            .filter(column.isnot(None))
+            .group_by(UniqueFlags.challenge_id, column)
+            .having(db.func.count(UniqueFlags.id) > 1)
+            .all()
+        )
+        for (challenge_id, account_id, keep_id) in duplicates:
+            UniqueFlags.query.filter(
+                UniqueFlags.challenge_id == challenge_id,
+                column == account_id,
+                UniqueFlags.id != keep_id
+            ).delete(synchronize_session=False)
+        db.session.commit()
+        db.session.execute(text(f"CREATE UNIQUE INDEX {name} ON unique_flags (challenge_id, {column.name})"))
+        db.session.commit()
+
+
+def _ensure_unique_placeholders(inspector):
+    """ Adds the unique constraint on placeholder offsets. Files which were indexed by two requests
+    at once have duplicate offsets, so their placeholders are removed for _index_legacy_files to redo. """
+    table = UniqueChallengeFilePlaceholder.__table__
+    existing = {tuple(c['column_names']) for c in inspector.get_unique_constraints(table.name)}
+    existing |= {tuple(i['column_names']) for i in inspector.get_indexes(table.name) if i['unique']}
+    if ('file_id', 'offset') in existing:
+        return
+    file_ids = [
+        file_id for (file_id,) in
+        db.session.query(table.c.file_id)
+        .group_by(table.c.file_id, table.c.offset)
+        .having(db.func.count(table.c.id) > 1)
+        .distinct()
+    ]
+    if file_ids:
+        db.session.execute(table.delete().where(table.c.file_id.in_(file_ids)))
+        UniqueChallengeFiles.query.filter(UniqueChallengeFiles.id.in_(file_ids)).update(
+            dict(placeholder_count=None), synchronize_session=False
+        )
+    db.session.commit()
+    db.Index("unique_file_placeholders_offset", table.c.file_id, table.c.offset, unique=True).create(bind=db.engine)
+
+
+def _ensure_columns(inspector, model, columns):
+    """ Adds any of the given nullable columns which are missing from the model's table """
+    table = model.__tablename__
+    existing = {c['name'] for c in inspector.get_columns(table)}
+    for column in columns:
+        if column.name in existing:
+            continue
+        column_type = column.type.compile(dialect=db.engine.dialect)
+        db.session.execute(text(f"ALTER TABLE {table} ADD COLUMN {column.name} {column_type}"))
+    db.session.commit()
+
+
+def _ensure_indexes(inspector, model):
+    """ Creates any of the model's indexes which are missing from its table """
+    existing = {i['name'] for i in inspector.get_indexes(model.__tablename__)}
+    for index in model.__table__.indexes:
+        if index.name not in existing:
+            index.create(bind=db.engine)
+
+
+def _backfill_metadata():
+    """ Fills in the size and hash of files and scripts saved before those columns existed.
+    Rows are loaded one at a time since each may hold a large BLOB. """
+    file_ids = [
+        file_id for (file_id,) in
+        UniqueChallengeFiles.query.with_entities(UniqueChallengeFiles.id).filter(UniqueChallengeFiles.sha256.is_(None))
+    ]
+    for file_id in file_ids:
+        file = UniqueChallengeFiles.query.filter_by(id=file_id).one()
+        if file.location is not None:
+            file.sha256 = file.location
+            file.size = content_size(file.location)
+        else:
+            content = file.content or b''
+            file.sha256 = hashlib.sha256(content).hexdigest()
+            file.size = len(content)
+        db.session.commit()
+        db.session.expunge(file)
+
+    script_ids = [
+        script_id for (script_id,) in
+        UniqueChallengeScript.query.with_entities(UniqueChallengeScript.id).filter(UniqueChallengeScript.sha256.is_(None))
+    ]
+    for script_id in script_ids:
+        script = UniqueChallengeScript.query.filter_by(id=script_id).one()
+        script.sha256 = hashlib.sha256(script.script or b'').hexdigest()
+        db.session.commit()
+        db.session.expunge(script)
+
+
+def _index_legacy_files():
+    """ Records the placeholders of files uploaded before placeholders were indexed, so that
+    downloads never need to index a file. Files are loaded one at a time since each may be large. """
+    # Imported here since helpers depends on most of CTFd, which migrations otherwise doesn't need.
+    from .helpers import index_unique_file, open_unique_file
+
+    file_ids = [
+        file_id for (file_id,) in
+        UniqueChallengeFiles.query.with_entities(UniqueChallengeFiles.id)
+        .filter(UniqueChallengeFiles.placeholder_count.is_(None))
+    ]
+    for file_id in file_ids:
+        file = UniqueChallengeFiles.query.filter_by(id=file_id).one()
+        with open_unique_file(file) as content:
+            index_unique_file(file, content)
+        db.session.commit()
+        db.session.expunge(file)
+
+
+def upgrade():
+    """ Applies any missing changes to the plugin's tables. Safe to run repeatedly. """
+    inspector = inspect(db.engine)
+    _ensure_unique_flags_constraints(inspector)
+    _ensure_columns(inspector, UniqueChallengeFiles, [
+        UniqueChallengeFiles.__table__.c.placeholder_count,
+        UniqueChallengeFiles.__table__.c.location,
+        UniqueChallengeFiles.__table__.c.size,
+        UniqueChallengeFiles.__table__.c.sha256,
+    ])
+    _ensure_columns(inspector, UniqueChallengeScript, [
+        UniqueChallengeScript.__table__.c.sha256,
+        UniqueChallengeScript.__table__.c.deterministic,
+    ])
+    _backfill_metadata()
+    _ensure_unique_placeholders(inspector)
+    _index_legacy_files()
+    _ensure_indexes(inspector, UniqueAuditFinding)
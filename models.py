@@ -10,6 +10,11 @@ class UniqueFlags(db.Model):
     the placeholders on submission.
     """
     __tablename__ = "unique_flags"
+    # NULLs are distinct, so these only apply to the column used by the current user/team mode.
+    __table_args__ = (
+        db.UniqueConstraint("challenge_id", "user_id", name="unique_flags_challenge_user"),
+        db.UniqueConstraint("challenge_id", "team_id", name="unique_flags_challenge_team"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     challenge_id = db.Column(
         db.Integer, db.ForeignKey("challenges.id", ondelete="CASCADE")
@@ -40,6 +45,7 @@ class UniqueChallenges(Challenges):
 
 class UniqueChallengeFiles(db.Model):
     """ Represents a file whose contents will be replaced when a user downloads it.
+    The content is deferred so that listing files does not load it, use the metadata columns instead.
     """
     __tablename__ = "unique_files"
     id = db.Column(db.Integer, primary_key=True)
@@ -47,14 +53,37 @@ class UniqueChallengeFiles(db.Model):
         db.Integer, db.ForeignKey("challenges.id", ondelete="CASCADE")
     )
     name = db.Column(db.String(64))
-    content = db.Column(db.BLOB)
+    # Only set for files uploaded before content was stored on disk, see storage.py
+    content = db.deferred(db.Column(db.BLOB))
+    # The sha256 of the content, which is stored on disk under this name
+    location = db.Column(db.String(64))
+    size = db.Column(db.BigInteger)
+    sha256 = db.Column(db.String(64))
+    # Null until the file's placeholders have been recorded in unique_file_placeholders
+    placeholder_count = db.Column(db.Integer)
 
     def __repr__(self):
         return f"<UniqueChallengeFile {self.id} {self.name} for challenge {self.challenge_id}>"
 
+class UniqueChallengeFilePlaceholder(db.Model):
+    """ The location of a placeholder within a unique file, recorded when the file is uploaded
+    so downloads can be produced by splicing values in without searching the file.
+    """
+    __tablename__ = "unique_file_placeholders"
+    # Indexing a file twice at once must not record a placeholder twice, or it would be spliced in twice.
+    __table_args__ = (
+        db.UniqueConstraint("file_id", "offset", name="unique_file_placeholders_offset"),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    file_id = db.Column(
+        db.Integer, db.ForeignKey("unique_files.id", ondelete="CASCADE"), index=True
+    )
+    offset = db.Column(db.BigInteger)
+    placeholder = db.Column(db.String(16))
+
 class UniqueChallengeScript(db.Model):
     """ Represents a python script provided by an administrator that will use the placeholders
-    to generate a file for a given user.
+    to generate a file for a given user. The script is deferred so that listing scripts does not load it.
     """
     __tablename__ = "unique_scripts"
     id = db.Column(db.Integer, primary_key=True)
@@ -62,7 +91,11 @@ class UniqueChallengeScript(db.Model):
         db.Integer, db.ForeignKey("challenges.id", ondelete="CASCADE")
     )
     name = db.Column(db.String(64))
-    script = db.Column(db.BLOB)
+    script = db.deferred(db.Column(db.BLOB))
+    # The sha256 of the script, updated whenever the script is
+    sha256 = db.Column(db.String(64))
+    # If set, the script always prints the same output for the same placeholders so its output may be cached
+    deterministic = db.Column(db.Boolean, default=False)
 
 class UniqueChallengeRequirements(db.Model):
     """ Represents a LispIsh script provided by an administrator that determines
@@ -75,6 +108,62 @@ class UniqueChallengeRequirements(db.Model):
     )
     script = db.Column(db.BLOB)
 
+class UniqueChallengeRequirementDependency(db.Model):
+    """ Something a challenge's requirement script depends on, extracted from the script
+    when it is saved. Used as a reverse index to find which challenges may change
+    visibility when something else changes.
+
+    kind is one of challenge, cohort, time, score or user. Challenges and cohorts are
+    referenced by target_id or target_name, if both are null the script computes which
+    challenge or cohort it references so any of them may affect it.
+    """
+    __tablename__ = "unique_requirement_dependencies"
+    __table_args__ = (
+        db.Index("unique_requirement_dependencies_target_id", "kind", "target_id"),
+        db.Index("unique_requirement_dependencies_target_name", "kind", "target_name"),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    challenge_id = db.Column(
+        db.Integer, db.ForeignKey("challenges.id", ondelete="CASCADE"), index=True
+    )
+    kind = db.Column(db.String(16))
+    target_id = db.Column(db.Integer)
+    target_name = db.Column(db.String(128))
+
+class UniqueAuditFinding(db.Model):
+    """ An incorrect submission which contains another account's unique flag, found by the audit.
+    Submissions are audited once, see helpers.start_audit_update.
+    """
+    __tablename__ = "unique_audit_findings"
+    # One for each ordering used by the audit page, see helpers.audit_sort_columns
+    __table_args__ = (
+        db.Index("unique_audit_findings_challenge", "challenge_id", "user_id", "id"),
+        db.Index("unique_audit_findings_user", "user_id", "challenge_id", "id"),
+        db.Index("unique_audit_findings_team", "team_id", "challenge_id", "id"),
+        db.Index("unique_audit_findings_source_user", "source_user_id", "id"),
+        db.Index("unique_audit_findings_source_team", "source_team_id", "id"),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    challenge_id = db.Column(
+        db.Integer, db.ForeignKey("challenges.id", ondelete="CASCADE")
+    )
+    submission_id = db.Column(
+        db.Integer, db.ForeignKey("submissions.id", ondelete="CASCADE"), index=True
+    )
+    user_id = db.Column(
+        db.Integer, db.ForeignKey("users.id", ondelete="CASCADE")
+    )
+    team_id = db.Column(
+        db.Integer, db.ForeignKey("teams.id", ondelete="CASCADE")
+    )
+    # The account whose flag was submitted
+    source_user_id = db.Column(
+        db.Integer, db.ForeignKey("users.id", ondelete="CASCADE")
+    )
+    source_team_id = db.Column(
+        db.Integer, db.ForeignKey("teams.id", ondelete="CASCADE")
+    )
+
 class UniqueChallengeCohort(db.Model):
     """ Represents a group of users created by an administrator. """
     __tablename__ = "unique_cohorts"
@@ -0,0 +1,127 @@
+"""
+Contains the placeholders which are replaced with unique values for each user/team, and
+templates which let text be split on those placeholders once and rendered many times.
+
+>>> template = compile_template("Hi !name!, your flag is !flag_8!")
+>>> render_template(template, dict(name='eve', flag_8='abcd1234'))
+'Hi eve, your flag is abcd1234'
+"""
+
+import re
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+PLACEHOLDERS = ('name', 'flag_8', 'flag_16', 'flag_32')
+PLACEHOLDER_REGEX = re.compile("|".join(f"!{name}!" for name in PLACEHOLDERS))
+PLACEHOLDER_TOKENS = tuple(bytes(f"!{name}!", 'ascii') for name in PLACEHOLDERS)
+PLACEHOLDER_BYTES_REGEX = re.compile(b"|".join(PLACEHOLDER_TOKENS))
+_LONGEST_TOKEN = max(len(token) for token in PLACEHOLDER_TOKENS)
+
+# Size of the chunks files are read and streamed in.
+CHUNK_SIZE = 64 * 1024
+
+# Static text is at even indexes, placeholder names at odd indexes.
+Template = Tuple[str, ...]
+
+
+def placeholder_values(flags, name: str) -> Dict[str, str]:
+    """ Gets the value of each placeholder for an account with the given flags """
+    return dict(
+        flag_8=flags.flag_8,
+        flag_16=flags.flag_16,
+        flag_32=flags.flag_32,
+        name=name
+    )
+
+
+def compile_template(text: str) -> Template:
+    """ Splits text into static segments and the placeholders between them.
+    >>> compile_template("!name!! is !flag_32")
+    ('', 'name', '! is !flag_32')
+    """
+    segments: List[str] = []
+    start = 0
+    for match in PLACEHOLDER_REGEX.finditer(text):
+        segments.append(text[start:match.start()])
+        segments.append(match.group(0)[1:-1])
+        start = match.end()
+    segments.append(text[start:])
+    return tuple(segments)
+
+
+def render_template(template: Template, values: Dict[str, str]) -> str:
+    """ Fills each placeholder slot in the template with its value """
+    parts = list(template)
+    for i in range(1, len(parts), 2):
+        parts[i] = values[parts[i]]
+    return ''.join(parts)
+
+
+def iter_chunks(content, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """ Splits a bytes-like object into chunks without copying all of it at once.
+    >>> list(iter_chunks(b'abcde', 2))
+    [b'ab', b'cd', b'e']
+    """
+    view = memoryview(content)
+    for start in range(0, len(view), chunk_size):
+        yield bytes(view[start:start + chunk_size])
+
+
+def _incomplete_token_start(buffer: bytes, start: int) -> int:
+    """ Finds where a placeholder which may be completed by the next chunk starts,
+    or the end of the buffer if there isn't one. Only considers positions from start. """
+    for i in range(max(start, len(buffer) - _LONGEST_TOKEN + 1), len(buffer)):
+        if buffer[i] == ord('!') and any(token.startswith(buffer[i:]) for token in PLACEHOLDER_TOKENS):
+            return i
+    return len(buffer)
+
+
+def find_placeholders(chunks: Iterable[bytes]) -> Iterator[Tuple[int, str]]:
+    """ Finds the offset and name of every placeholder in a stream of chunks. The end of
+    a chunk is held back if it may be the start of a placeholder split across chunks.
+    >>> list(find_placeholders([b'Hi !na', b'me!, flag: !', b'flag_8!!']))
+    [(3, 'name'), (17, 'flag_8')]
+    """
+    carry = b''
+    carry_offset = 0
+    for chunk in chunks:
+        buffer = carry + chunk
+        end = 0
+        for match in PLACEHOLDER_BYTES_REGEX.finditer(buffer):
+            yield carry_offset + match.start(), match.group(0)[1:-1].decode('ascii')
+            end = match.end()
+        cut = _incomplete_token_start(buffer, end)
+        carry = buffer[cut:]
+        carry_offset += cut
+    for match in PLACEHOLDER_BYTES_REGEX.finditer(carry):
+        yield carry_offset + match.start(), match.group(0)[1:-1].decode('ascii')
+
+
+def splice_placeholders(content, offsets: Iterable[Tuple[int, str]], values: Dict[str, bytes],
+                        chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """ Streams content with the placeholders at the given offsets replaced, without searching
+    the content. Static ranges are sliced from a memoryview and sent in chunks.
+    >>> content = b'Hi !name!, flag: !flag_8!!'
+    >>> values = dict(name=b'eve', flag_8=b'12345678')
+    >>> b''.join(splice_placeholders(content, find_placeholders([content]), values, 4))
+    b'Hi eve, flag: 12345678!'
+    """
+    view = memoryview(content)
+    start = 0
+    for (offset, name) in offsets:
+        yield from iter_chunks(view[start:offset], chunk_size)
+        yield values[name]
+        start = offset + len(name) + 2
+    yield from iter_chunks(view[start:], chunk_size)
+
+
+def spliced_length(size: int, offsets: Iterable[Tuple[int, str]], values: Dict[str, bytes]) -> int:
+    """ Computes the length of content after splice_placeholders.
+    >>> spliced_length(26, [(3, 'name'), (17, 'flag_8')], dict(name=b'eve', flag_8=b'12345678'))
+    23
+    """
+    return size + sum(len(values[name]) - len(name) - 2 for (_, name) in offsets)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,280 @@
+"""
+Runs the administrator provided python scripts which generate unique files.
+
+Downloads run scripts in a ScriptPool of worker processes so that a script swapping sys.stdout
+cannot corrupt other requests, and a slow or runaway script cannot block a web worker.
+The pool works under gevent, which CTFd's gunicorn configuration uses.
+
+>>> code = compile_script(1, "print(PLACEHOLDERS['name'])")
+>>> CaptureExec(code).run(dict(PLACEHOLDERS=dict(name='eve')))
+'eve\\n'
+>>> pool = ScriptPool(workers=1, queue_size=2, cpu_seconds=5, wall_seconds=1, memory_bytes=None)
+>>> pool.run(dump_script(code), dict(PLACEHOLDERS=dict(name='eve')))
+ScriptResult(output='eve\\n', error=None)
+>>> pool.run("while True: pass", {}).error
+'Script exceeded its time limit'
+>>> pool.close()
+"""
+
+import io
+import os
+import sys
+import math
+import time
+import queue
+import pickle
+import marshal
+import signal
+import socket
+import threading
+import multiprocessing
+from collections import namedtuple
+from contextlib import redirect_stdout
+from types import CodeType
+from typing import Optional, Union
+
+try:
+    import resource
+except ImportError:  # Not available on Windows, where limits other than wall-clock time are not enforced.
+    resource = None
+
+ERROR_OUTPUT = "ERROR CREATING FILE: CONTACT AN ADMINISTRATOR\n"
+
+ScriptResult = namedtuple('ScriptResult', ['output', 'error'])
+ScriptResult.__doc__ = """ The output of a script, and a description of what went wrong if it did not complete. """
+
+
+class ScriptLimitExceeded(BaseException):
+    """ Raised within a worker when a script exceeds a limit. This is not an Exception so that
+    scripts catching Exception don't keep running. """
+
+
+class ScriptQueueFull(Exception):
+    """ Raised when too many scripts are waiting to be run. """
+
+
+def _execute(script: Union[str, CodeType], local_vars) -> ScriptResult:
+    """ Runs a script, capturing its output in a buffer. """
+    out = io.StringIO()
+    error = None
+    # Run user script, note that builtins are enabled. Untrusted input
+    # should not be passed to this function.
+    with redirect_stdout(out):
+        try:
+            exec(script, {}, local_vars)
+        except MemoryError:
+            print(ERROR_OUTPUT, end='')
+            error = "Script exceeded its memory limit"
+        except Exception as e:
+            print(ERROR_OUTPUT, end='')
+            error = str(e)
+    return ScriptResult(out.getvalue(), error)
+
+
+class CaptureExec:
+    """ Helper class to wrap user scripts that print to stdout.
+    The script may be source code or a code object from compile_script.
+    This swaps sys.stdout, so should only be used where a single script runs at a time.
+    """
+    def __init__(self, script: Union[str, CodeType]):
+        self._script = script
+
+    def run(self, local_vars={}) -> str:
+        result = _execute(self._script, local_vars)
+        if result.error is not None:
+            print("Exception when running admin code to generate a file:", file=sys.stderr)
+            print(result.error, file=sys.stderr)
+        return result.output
+
+
+def compile_script(script_id: int, source: str) -> Union[str, CodeType]:
+    """ Compiles a script so that it can be run repeatedly without being parsed each time.
+    Scripts with syntax errors are returned as source so that CaptureExec reports the error when run.
+    """
+    try:
+        return compile(source, f"<unique script {script_id}>", 'exec')
+    except SyntaxError:
+        return source
+
+
+def dump_script(script: Union[str, CodeType]) -> Union[str, bytes]:
+    """ Converts a script from compile_script to something which can be sent to a worker process.
+    Code objects cannot be pickled, but can be marshalled.
+    """
+    return marshal.dumps(script) if isinstance(script, CodeType) else script
+
+
+def _raise_limit(signum, frame):
+    if signum == signal.SIGALRM:
+        raise ScriptLimitExceeded("Script exceeded its time limit")
+    raise ScriptLimitExceeded("Script exceeded its CPU time limit")
+
+
+def _init_worker(memory_bytes: Optional[int]):
+    """ Prepares a worker process to run scripts. """
+    signal.signal(signal.SIGALRM, _raise_limit)
+    if resource is None:
+        return
+    signal.signal(signal.SIGXCPU, _raise_limit)
+    if memory_bytes:
+        # An exception here would make the pool respawn workers forever, so the memory limit is
+        # skipped where it can't be set, such as on macOS, which has no /proc and doesn't enforce RLIMIT_AS.
+        try:
+            # The limit is on top of what the worker already uses, which is mostly the plugin's imports.
+            with open('/proc/self/statm') as statm:
+                used = int(statm.read().split()[0]) * resource.getpagesize()
+            resource.setrlimit(resource.RLIMIT_AS, (used + memory_bytes, resource.getrlimit(resource.RLIMIT_AS)[1]))
+        except (OSError, ValueError) as e:
+            print(f"Unable to limit the memory used by generated file scripts: {e}", file=sys.stderr)
+
+
+def _run_job(script: Union[str, bytes], local_vars, cpu_seconds: int, wall_seconds: float) -> ScriptResult:
+    """ Runs a script in a worker process with limits on its CPU and wall-clock time. """
+    if isinstance(script, bytes):
+        script = marshal.loads(script)
+    if resource is not None:
+        hard = resource.getrlimit(resource.RLIMIT_CPU)[1]
+        used = time.process_time()
+        resource.setrlimit(resource.RLIMIT_CPU, (math.ceil(used + cpu_seconds), hard))
+    signal.setitimer(signal.ITIMER_REAL, wall_seconds)
+    try:
+        return _execute(script, local_vars)
+    except ScriptLimitExceeded as e:
+        return ScriptResult(ERROR_OUTPUT, str(e))
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        if resource is not None:
+            resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+
+
+def _send(conn: socket.socket, message):
+    data = pickle.dumps(message)
+    conn.sendall(len(data).to_bytes(8, 'big') + data)
+
+
+def _receive_exactly(conn: socket.socket, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise EOFError("Script worker closed its connection")
+        data += chunk
+    return bytes(data)
+
+
+def _receive(conn: socket.socket):
+    size = int.from_bytes(_receive_exactly(conn, 8), 'big')
+    return pickle.loads(_receive_exactly(conn, size))
+
+
+def _worker_main(conn: socket.socket, memory_bytes: Optional[int]):
+    """ Runs jobs sent by a _Worker until its connection is closed """
+    _init_worker(memory_bytes)
+    while True:
+        try:
+            job = _receive(conn)
+        except EOFError:
+            return
+        _send(conn, _run_job(*job))
+
+
+class _Worker:
+    """ A forked process which runs scripts one at a time, sent over a socket. Sockets are used rather
+    than multiprocessing.Pool because gevent, which CTFd's gunicorn configuration uses, makes socket
+    operations cooperative when it monkey patches, while Pool's handler threads block the whole worker. """
+    def __init__(self, memory_bytes: Optional[int]):
+        self._conn, child = socket.socketpair()
+        context = multiprocessing.get_context('fork')
+        self._process = context.Process(target=_worker_main, args=(child, memory_bytes), daemon=True)
+        self._process.start()
+        child.close()
+
+    def call(self, job: tuple, timeout: float) -> ScriptResult:
+        """ Runs a job, raising OSError or EOFError if the worker doesn't respond within timeout seconds. """
+        self._conn.settimeout(timeout)
+        _send(self._conn, job)
+        return _receive(self._conn)
+
+    def kill(self):
+        self._conn.close()
+        if self._process.is_alive():
+            self._process.kill()
+        self._process.join()
+
+
+class ScriptPool:
+    """ A bounded pool of worker processes which run scripts with CPU time, wall-clock time and
+    memory limits. At most queue_size scripts may be running or waiting at once, further scripts
+    raise ScriptQueueFull instead of waiting. Works with threads and with gevent's monkey patching.
+
+    Workers are forked, ideally before the web server starts any threads. If the process forks after
+    the pool is created, as gunicorn does with preloading, the pool is recreated in the child.
+    """
+    def __init__(self, workers: int, queue_size: int, cpu_seconds: int, wall_seconds: float,
+                 memory_bytes: Optional[int]):
+        self._workers = workers
+        self._cpu_seconds = cpu_seconds
+        self._wall_seconds = wall_seconds
+        self._memory_bytes = memory_bytes
+        self._slots = threading.BoundedSemaphore(queue_size)
+        # Queued jobs may wait for every job ahead of them before starting.
+        self._wait_timeout = wall_seconds * math.ceil(queue_size / workers) + 5
+        self._lock = threading.Lock()
+        self._idle = None
+        self._pid = None
+
+    def _get_idle(self) -> queue.Queue:
+        """ Gets the queue of workers waiting for a job, starting the workers if needed """
+        with self._lock:
+            if self._idle is None or self._pid != os.getpid():
+                # Workers inherited from a parent process belong to it, so new ones are started.
+                self._idle = queue.Queue()
+                for _ in range(self._workers):
+                    self._idle.put(_Worker(self._memory_bytes))
+                self._pid = os.getpid()
+            return self._idle
+
+    @property
+    def workers(self) -> int:
+        return self._workers
+
+    def start(self):
+        """ Starts the workers now rather than when the first script is run """
+        self._get_idle()
+
+    def run(self, script: Union[str, bytes], local_vars) -> ScriptResult:
+        """ Runs a script from dump_script in a worker, waiting for it to finish. """
+        if not self._slots.acquire(blocking=False):
+            raise ScriptQueueFull()
+        try:
+            idle = self._get_idle()
+            try:
+                worker = idle.get(timeout=self._wait_timeout)
+            except queue.Empty:
+                return ScriptResult(ERROR_OUTPUT, "Timed out waiting for a script worker")
+            job = (script, local_vars, self._cpu_seconds, self._wall_seconds)
+            try:
+                return worker.call(job, self._wall_seconds + 5)
+            except (OSError, EOFError) as e:
+                # The worker is stuck somewhere the time limits cannot interrupt, or it died.
+                worker.kill()
+                worker = _Worker(self._memory_bytes)
+                if isinstance(e, socket.timeout):
+                    return ScriptResult(ERROR_OUTPUT, "Script did not respond to its time limit")
+                return ScriptResult(ERROR_OUTPUT, "Script worker stopped unexpectedly")
+            finally:
+                idle.put(worker)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """ Stops every worker """
+        with self._lock:
+            idle, self._idle = self._idle, None
+        while idle is not None and not idle.empty():
+            idle.get().kill()
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
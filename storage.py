@@ -0,0 +1,107 @@
+"""
+Stores the content of unique files on disk instead of in the database. Content is
+keyed by its sha256 so identical uploads share a file, and is read through mmap so
+downloads are served from the page cache without copying the whole file into memory.
+
+Files are stored in UNIQUE_CHALLENGES_STORAGE_PATH if it is set in the app config
+or environment, otherwise in a unique_files folder in CTFd's upload folder. Rendered
+downloads are cached in the rendered folder within it, limited to
+UNIQUE_CHALLENGES_RENDERED_CACHE_BYTES, and the output of deterministic scripts in the
+generated folder, limited to UNIQUE_CHALLENGES_GENERATED_CACHE_BYTES.
+"""
+
+import os
+import mmap
+import hashlib
+import tempfile
+from contextlib import contextmanager
+from typing import Iterable, Optional
+
+from flask import current_app
+
+from .caching import DiskCache
+
+
+def storage_setting(name: str, default=None):
+    """ Gets a setting from the app config, falling back to the environment """
+    return current_app.config.get(name) or os.environ.get(name) or default
+
+
+def storage_root() -> str:
+    """ Gets the folder unique file content is stored in """
+    return storage_setting(
+        'UNIQUE_CHALLENGES_STORAGE_PATH',
+        os.path.join(current_app.config['UPLOAD_FOLDER'], 'unique_files')
+    )
+
+
+def rendered_cache() -> DiskCache:
+    """ Gets the cache of unique files rendered for a particular account """
+    return DiskCache(
+        os.path.join(storage_root(), 'rendered'),
+        int(storage_setting('UNIQUE_CHALLENGES_RENDERED_CACHE_BYTES', 256 * 1024 * 1024))
+    )
+
+
+def generated_cache() -> DiskCache:
+    """ Gets the cache of files output by deterministic generated file scripts """
+    return DiskCache(
+        os.path.join(storage_root(), 'generated'),
+        int(storage_setting('UNIQUE_CHALLENGES_GENERATED_CACHE_BYTES', 256 * 1024 * 1024))
+    )
+
+
+def content_path(location: str) -> str:
+    """ Gets the path of the file stored at the given location """
+    return os.path.join(storage_root(), location[:2], location)
+
+
+def store_content(content: bytes) -> str:
+    """ Writes content to disk if it is not already stored and returns its location.
+    The file is written to a temporary name and renamed so readers never see a partial file.
+    """
+    location = hashlib.sha256(content).hexdigest()
+    path = content_path(location)
+    if os.path.exists(path):
+        return location
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.replace(temp, path)
+    except BaseException:
+        os.unlink(temp)
+        raise
+    return location
+
+
+def content_size(location: str) -> int:
+    """ Gets the size of the content stored at the given location """
+    return os.path.getsize(content_path(location))
+
+
+@contextmanager
+def open_content(location: str):
+    """ Maps the content stored at the given location into memory, read only.
+    Empty files cannot be mapped, so they are returned as empty bytes.
+    """
+    with open(content_path(location), 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b''
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+            yield content
+
+
+def remove_content(locations: Iterable[Optional[str]]):
+    """ Removes stored content from disk. Callers are responsible for
+    ensuring that nothing references the locations anymore. """
+    for location in set(locations):
+        if not location:
+            continue
+        try:
+            os.unlink(content_path(location))
+        except FileNotFoundError:
+            pass
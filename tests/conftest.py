@@ -0,0 +1,60 @@
+"""
+Fixtures for the plugin's tests, which need CTFd with this plugin installed as CTFd/plugins/unique_challenges.
+Tests are skipped when CTFd can't be imported.
+"""
+import sys
+import tempfile
+from os.path import join, dirname, abspath
+sys.path.append(abspath(join(dirname(__file__), '..', '..', '..', '..')))
+
+import pytest
+
+
+@pytest.fixture
+def app():
+    """ A set up CTFd app in users mode with an in-memory database, inside an app context """
+    pytest.importorskip("CTFd")
+    from CTFd import create_app
+    from CTFd.cache import cache
+    from CTFd.config import Config
+    from CTFd.models import db
+    from CTFd.utils import set_config
+
+    with tempfile.TemporaryDirectory() as directory:
+        class TestingConfig(Config):
+            SECRET_KEY = "AAAAAAAAAAAAAAAAAAAA"
+            PRESERVE_CONTEXT_ON_EXCEPTION = False
+            TESTING = True
+            SQLALCHEMY_DATABASE_URI = "sqlite://"
+            SERVER_NAME = "localhost"
+            UPDATE_CHECK = False
+            REDIS_URL = None
+            CACHE_TYPE = "simple"
+            UPLOAD_FOLDER = directory
+            UNIQUE_CHALLENGES_SCRIPT_WORKERS = 1
+
+        app = create_app(TestingConfig)
+        with app.app_context():
+            set_config('setup', True)
+            set_config('user_mode', 'users')
+            yield app
+            cache.clear()
+            db.session.remove()
+            db.drop_all()
+
+
+@pytest.fixture
+def admin_client(app):
+    """ A test client logged in as an admin """
+    from CTFd.models import db, Admins
+
+    admin = Admins(name="admin", email="admin@example.com", password="password")
+    db.session.add(admin)
+    db.session.commit()
+    with app.test_client() as client:
+        with client.session_transaction() as session:
+            session['id'] = admin.id
+            session['name'] = admin.name
+            session['type'] = admin.type
+            session['nonce'] = "nonce"
+        yield client
@@ -0,0 +1,70 @@
+import time
+
+import pytest
+
+from utils import add_challenge, add_users
+
+pytest.importorskip("CTFd")
+
+
+def add_findings(count: int):
+    """ Adds count findings, each submitted by a different user with a different user's flag """
+    from CTFd.models import db, Fails
+    from CTFd.plugins.unique_challenges.models import UniqueAuditFinding
+
+    challenge = add_challenge()
+    users = add_users(count + 1)
+    fails = [
+        Fails(user_id=user.id, challenge_id=challenge.id, ip="127.0.0.1", provided="flag")
+        for user in users[:count]
+    ]
+    db.session.add_all(fails)
+    db.session.flush()
+    db.session.add_all(
+        UniqueAuditFinding(challenge_id=challenge.id, submission_id=fail.id, user_id=fail.user_id,
+                           source_user_id=fail.user_id + 1)
+        for fail in fails
+    )
+    db.session.commit()
+
+
+def count_statements(client, url: str):
+    """ Gets url, returning the response and the number of statements it ran """
+    from sqlalchemy import event
+    from CTFd.models import db
+
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+    return response, len(statements)
+
+
+def test_audit_list_queries_are_bounded(app, admin_client):
+    """ The number of queries for a page of the audit doesn't depend on the size of the page """
+    from CTFd.cache import cache
+    from CTFd.plugins.unique_challenges.helpers import AUDIT_STATUS_KEY
+
+    add_findings(120)
+    # Mark the audit as just updated, so the list doesn't start an update whose queries would be counted.
+    now = time.time()
+    cache.set(AUDIT_STATUS_KEY, dict(running=False, rebuild=False, started=now, updated=now, finished=now,
+                                     error=None, checked=0, total=0, found=0), timeout=0)
+
+    counts = []
+    for limit in (5, 100):
+        response, count = count_statements(admin_client, f"/api/unique/audit?limit={limit}")
+        data = response.get_json()
+        assert data['status'] == 'ok'
+        assert len(data['suspect']) == limit
+        assert len(data['users']) == limit + 1
+        counts.append(count)
+    assert counts[0] == counts[1]
+
+    response, count = count_statements(admin_client, "/api/unique/audit?limit=100&cursor=" + data['next'])
+    assert len(response.get_json()['suspect']) == 20
+    assert count <= counts[0]
@@ -0,0 +1,38 @@
+import hashlib
+
+import pytest
+
+from utils import add_challenge, add_users
+
+pytest.importorskip("CTFd")
+
+
+def test_warm_up_reports_progress_while_running(app):
+    """ Progress is reported from the calling thread while scripts are still running, not only at the end """
+    from CTFd.cache import cache
+    from CTFd.models import db
+    from CTFd.plugins.unique_challenges.helpers import WARMUP_STATUS_KEY, warm_generated_files
+    from CTFd.plugins.unique_challenges.models import UniqueChallengeScript
+
+    challenge = add_challenge()
+    add_users(8)
+    source = b"import time\ntime.sleep(0.4)\nprint('generated')\n"
+    db.session.add(UniqueChallengeScript(
+        challenge_id=challenge.id, name="slow.txt", script=source,
+        sha256=hashlib.sha256(source).hexdigest(), deterministic=True
+    ))
+    db.session.commit()
+
+    reports = []
+
+    def progress(status):
+        # The status is updated in place, so take a copy along with what the cache held at the time.
+        reports.append((dict(status), cache.get(WARMUP_STATUS_KEY)['done']))
+
+    status = warm_generated_files(progress=progress)
+
+    assert status['done'] == status['total'] == 8
+    assert status['failed'] == 0
+    during = [(report, cached) for (report, cached) in reports if report['running'] and 0 < report['done'] < 8]
+    assert during, "No progress was reported while the scripts were running"
+    assert all(cached == report['done'] for (report, cached) in during)
@@ -0,0 +1,22 @@
+""" Functions for adding test data, used by the tests """
+
+
+def add_users(count: int):
+    """ Adds count users, returning them """
+    from CTFd.models import db, Users
+
+    users = [Users(name=f"user{i}", email=f"user{i}@example.com", password="password") for i in range(count)]
+    db.session.add_all(users)
+    db.session.commit()
+    return users
+
+
+def add_challenge(name: str = "challenge"):
+    """ Adds a visible unique challenge, returning it """
+    from CTFd.models import db
+    from CTFd.plugins.unique_challenges.models import UniqueChallenges
+
+    challenge = UniqueChallenges(name=name, description="", value=10, category="test", state="visible")
+    db.session.add(challenge)
+    db.session.commit()
+    return challenge